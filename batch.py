@@ -0,0 +1,99 @@
+import os
+import json
+import time
+import argparse
+import traceback
+import multiprocessing
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from osdp import get_settings, get_clone_path, predict_and_suggest
+from rate_limit import create_shared_budget
+
+WORKERS = 4
+OUTPUT_PATH = os.path.join(".autodp", "batch.json")
+LOG_DIR = os.path.join(".autodp", "logs")
+
+
+def read_repositories(path):
+    """ Returns the (repository, commit sha) of each line, lines starting with # are skipped """
+    repositories = []
+    with open(path, encoding="utf-8") as repositories_file:
+        for line in repositories_file:
+            fields = line.split()
+            if len(fields) == 0 or fields[0].startswith("#"):
+                continue
+            repositories.append((fields[0], fields[1] if len(fields) > 1 else None))
+    return repositories
+
+
+def score_repository(index, repository, commit_sha, budget, log_dir):
+    """ Predicts one line of the list in a worker process, its output goes to a log file of its own """
+    name = repository.replace("/", "_")
+    # a repository can be listed for several commits, the log and report of a line are named by its position and
+    # the model and training set by the repository and commit
+    run_name = f"{index}_{name}"
+    start = time.time()
+    log_path = os.path.join(log_dir, f"{run_name}.log")
+    os.makedirs(log_dir, exist_ok=True)
+    with open(log_path, "w", encoding="utf-8") as log_file, redirect_stdout(log_file):
+        try:
+            settings = get_settings({"REPOSITORY": repository, "COMMIT_SHA": commit_sha,
+                                     "REPORT_PATH": os.path.join(log_dir, f"{run_name}.json"),
+                                     "MODEL_NAME": f"{name}_{commit_sha}" if commit_sha else name})
+            # one LOCAL_CLONE setting would point every repository to the same clone
+            if settings["LOCAL_CLONE"]:
+                settings["LOCAL_CLONE"] = get_clone_path(repository)
+            result = predict_and_suggest(settings, budget)
+            status = "success" if result is not None else "skipped"
+            error = None
+        except Exception as e:
+            traceback.print_exc(file=log_file)
+            result = None
+            status = "failure"
+            error = f"{type(e).__name__}: {e}"
+    return {"index": index, "repository": repository, "commit_sha": commit_sha, "status": status, "error": error,
+            "wall_time": time.time() - start, "log": log_path, "result": result}
+
+
+def run_batch(repositories, workers=WORKERS, output_path=OUTPUT_PATH, log_dir=LOG_DIR):
+    """ Predicts the repositories in parallel processes which share one rate limit budget, writes all results """
+    start = time.time()
+    results = []
+    with multiprocessing.Manager() as manager:
+        budget = create_shared_budget(manager)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(score_repository, index, repository, commit_sha, budget, log_dir)
+                       for index, (repository, commit_sha) in enumerate(repositories)]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                probability = result["result"]["defect_probability"] if result["result"] else None
+                commit = f"@{result['commit_sha']}" if result["commit_sha"] else ""
+                print(f"{result['repository']}{commit}: {result['status']} in {result['wall_time']:.0f}s"
+                      + (f", defect probability {probability:.2%}" if probability is not None else "")
+                      + (f", {result['error']}" if result["error"] else ""))
+    results.sort(key=lambda result: result["index"])
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as output_file:
+        json.dump({"date": datetime.now().isoformat(timespec="seconds"), "wall_time": time.time() - start,
+                   "repositories": results}, output_file, indent=2)
+    print(f"Wrote the results of {len(results)} repositories to {output_path}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Predicts the defect probability of many repositories in parallel, "
+                                                 "the other settings are read like for osdp.py")
+    parser.add_argument("repositories", help="a file with one repository and an optional commit sha per line")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="the count of parallel processes")
+    parser.add_argument("--output", default=OUTPUT_PATH, help="the JSON file of the combined results")
+    parser.add_argument("--logs", default=LOG_DIR, help="the directory of the logs and reports of each repository")
+    arguments = parser.parse_args()
+    run_batch(read_repositories(arguments.repositories), arguments.workers, arguments.output, arguments.logs)
+
+
+if __name__ == '__main__':
+    main()
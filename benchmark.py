@@ -0,0 +1,173 @@
+import io
+import os
+import sys
+import json
+import argparse
+import subprocess
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from detector import Detector
+from estimator import Estimator
+from github_adapter import GithubAdapter, API_URL
+from graphql_adapter import GraphqlAdapter, GRAPHQL_URL
+from pipeline import run_pipeline
+from profiling import Profiler
+from rate_limit import RateLimitScheduler
+from replay_server import ReplayServer, SyntheticRepository, RecordedResponses, RecordingScheduler
+
+SIZES = [500, 1000, 5000, 20000]
+BACKENDS = ["github", "graphql"]
+RESULTS_PATH = os.path.join(".autodp", "benchmark.jsonl")
+REPLAY_TOKEN = "replay"
+
+
+def create_pipeline(profiler, scheduler, token, repository, commit_sha, backend, commit_limit, api_url, graphql_url):
+    with profiler.stage("initialization"):
+        if backend == "graphql":
+            adaptor = GraphqlAdapter(token, repository, commit_sha, None, None, graphql_url, scheduler, api_url,
+                                     commit_limit)
+        else:
+            adaptor = GithubAdapter(token, repository, commit_sha, None, scheduler, api_url, commit_limit)
+        detector = Detector(token, repository, commit_sha, graphql_url, scheduler)
+        estimator = Estimator(repository)
+    return adaptor, detector, estimator
+
+
+def run_benchmark(api_url, repository, commit_sha, backend, commit_limit, verbose=False):
+    """ Runs the whole pipeline against the stand-in and returns the run report, in a fresh process per run """
+    profiler = Profiler()
+    scheduler = RateLimitScheduler(profiler)
+    output = sys.stdout if verbose else io.StringIO()
+    with redirect_stdout(output):
+        pipeline = create_pipeline(profiler, scheduler, REPLAY_TOKEN, repository, commit_sha, backend, commit_limit,
+                                   api_url, f"{api_url}/graphql")
+        result = run_pipeline(profiler, *pipeline)
+    report = profiler.get_report()
+    report.pop("commits")
+    report["result"] = result
+    return report
+
+
+def benchmark(source, name, commit_sha, backends, commit_limit, results_path, verbose):
+    server = ReplayServer(source).start()
+    try:
+        for backend in backends:
+            # a fresh process keeps the peak memory and the PyGithub state of the runs apart
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                report = executor.submit(run_benchmark, server.url, source.repository, commit_sha, backend,
+                                         commit_limit, verbose).result()
+            row = {
+                "version": get_version(),
+                "date": datetime.now().isoformat(timespec="seconds"),
+                "source": name,
+                "commit_limit": commit_limit,
+                "backend": backend,
+                "commit_count": report["result"]["commit_count"] if report["result"] else None,
+                "wall_time": report["wall_time"],
+                "stages": {stage["name"]: stage["wall_time"] for stage in report["stages"]},
+                "requests": sum(report["requests"].values()),
+                "graphql_cost": report["graphql_cost"],
+                "peak_memory": report["peak_memory"],
+            }
+            print_row(row, load_previous_row(results_path, row))
+            save_row(results_path, row)
+    finally:
+        server.stop()
+
+
+def record(path, backends, commit_limit):
+    """ Runs the pipeline against GitHub with the settings of the environment and records every response """
+    token = os.environ.get("TOKEN")
+    repository = os.environ.get("REPOSITORY")
+    if token is None or repository is None:
+        raise Exception("Recording needs the TOKEN and REPOSITORY environment variables")
+    commit_sha = os.environ.get("COMMIT_SHA") or None
+    api_url = os.environ.get("API_URL", API_URL)
+    graphql_url = os.environ.get("GRAPHQL_URL", GRAPHQL_URL)
+    profiler = Profiler()
+    scheduler = RecordingScheduler(profiler)
+    for backend in backends:
+        pipeline = create_pipeline(profiler, scheduler, token, repository, commit_sha, backend, commit_limit, api_url,
+                                   graphql_url)
+        run_pipeline(profiler, *pipeline)
+    scheduler.save(path, repository, commit_sha, commit_limit, backends, api_url, graphql_url)
+    print(f"Recorded {len(scheduler.responses)} responses to {path}")
+
+
+def get_version():
+    try:
+        version = subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                                 check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return version
+
+
+def load_previous_row(results_path, row):
+    """ Returns the latest result of the same benchmark by another version """
+    if not os.path.isfile(results_path):
+        return None
+    previous_row = None
+    with open(results_path, encoding="utf-8") as results_file:
+        for line in results_file:
+            result = json.loads(line)
+            if all(result[key] == row[key] for key in ["source", "commit_limit", "backend"]) \
+                    and result["version"] != row["version"]:
+                previous_row = result
+    return previous_row
+
+
+def save_row(results_path, row):
+    if os.path.dirname(results_path):
+        os.makedirs(os.path.dirname(results_path), exist_ok=True)
+    with open(results_path, "a", encoding="utf-8") as results_file:
+        results_file.write(json.dumps(row) + "\n")
+
+
+def print_row(row, previous_row):
+    stages = ", ".join(f"{name} {wall_time:.2f}s" for name, wall_time in row["stages"].items())
+    print(f"{row['source']} ({row['backend']}, {row['commit_count']} commits): {row['wall_time']:.2f}s, "
+          f"{row['requests']} requests, GraphQL cost {row['graphql_cost']}, "
+          f"peak memory {row['peak_memory'] / 2 ** 20:.0f} MiB\n    {stages}")
+    if previous_row is not None:
+        change = (row["wall_time"] - previous_row["wall_time"]) / previous_row["wall_time"]
+        print(f"    {change:+.1%} against {previous_row['version']} ({previous_row['wall_time']:.2f}s, "
+              f"{previous_row['requests']} requests)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times the pipeline offline against a stand-in for the GitHub APIs")
+    parser.add_argument("--backend", action="append", choices=BACKENDS, help="the backends to time, all by default")
+    parser.add_argument("--results", default=RESULTS_PATH, help="the JSON lines file tracking the results")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the pipeline")
+    commands = parser.add_subparsers(dest="command", required=True)
+    synthetic = commands.add_parser("synthetic", help="time synthetic repositories")
+    synthetic.add_argument("sizes", nargs="*", type=int, default=SIZES, help="the commit counts of the repositories")
+    synthetic.add_argument("--seed", type=int, default=0)
+    replay = commands.add_parser("replay", help="time a recorded fixture")
+    replay.add_argument("fixture")
+    recording = commands.add_parser("record", help="record a fixture from GitHub, configured by the environment")
+    recording.add_argument("fixture")
+    recording.add_argument("--commit-limit", type=int, default=500)
+    arguments = parser.parse_args()
+    backends = arguments.backend or BACKENDS
+
+    if arguments.command == "synthetic":
+        for size in arguments.sizes:
+            print(f"Generating a synthetic repository with {size} commits")
+            source = SyntheticRepository(size, arguments.seed)
+            benchmark(source, f"synthetic-{size}-{arguments.seed}", None, backends, size, arguments.results,
+                      arguments.verbose)
+    elif arguments.command == "replay":
+        source = RecordedResponses(arguments.fixture)
+        benchmark(source, os.path.basename(arguments.fixture), source.commit_sha,
+                  [backend for backend in backends if backend in source.backends], source.commit_limit,
+                  arguments.results, arguments.verbose)
+    else:
+        record(arguments.fixture, backends, arguments.commit_limit)
+
+
+if __name__ == '__main__':
+    main()
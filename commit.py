@@ -1,29 +1,35 @@
+from feature_store import FeatureStore
+
+
 class Commit:
 
-    def __init__(self):
-        """ A simple feature container for each git commit """
-        self.features = {}
+    def __init__(self, store=None):
+        """ A view of the features of one git commit, stored as a new row of a feature store """
+        self.store = store if store is not None else FeatureStore()
+        self.row = self.store.append()
 
     def add(self, key, value):
-        if key in self.features:
+        if self.store.has(self.row, key):
             raise Exception("Do not overwrite features")
-        self.features[key] = value
+        self.store.set(self.row, key, value)
 
     def remove(self, key):
-        if key in self.features:
-            return self.features.pop(key)
+        if self.store.has(self.row, key):
+            value = self.store.get(self.row, key)
+            self.store.unset(self.row, key)
+            return value
         raise Exception(f"The commit object does not have the feature: {key}")
 
     def get(self, key):
-        if key in self.features:
-            return self.features[key]
+        if self.store.has(self.row, key):
+            return self.store.get(self.row, key)
         raise Exception(f"The commit object does not have the feature: {key}")
 
     def get_all(self):
-        return self.features.copy()
+        return {key: self.store.get(self.row, key) for key in self.store.keys(self.row)}
 
     def to_list(self):
-        tmp = self.features.copy()
+        tmp = self.get_all()
         tmp.pop("message", None)
         tmp.pop("files", None)
         return list(tmp.values())
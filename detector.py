@@ -1,33 +1,131 @@
-import requests
+import json
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from issue_index import IssueIndex, get_timestamp
+from rate_limit import RateLimitScheduler
+
+GRAPHQL_URL = "https://api.github.com/graphql"
+BLAME_BATCH_SIZE = 10
+BLAME_WORKERS = 8
+MAX_PENDING_BLAMES = 16
+FIX_CONFIRMATIONS = ["issues", "keywords"]
 
 
 class Detector:
 
-    def __init__(self, token, repository, commit):
+    def __init__(self, token, repository, commit, url=GRAPHQL_URL, scheduler=None, cache=None,
+                 fix_confirmation="issues"):
         self.token = token
         self.repository = repository
         self.commit = commit
+        self.url = url
         self.commits = None
         self.ignored_commits = {}
+        self.scheduler = scheduler if scheduler is not None else RateLimitScheduler()
+        self.blame_targets = []
+        self.blame_futures = deque()
+        self.executor = None
+        self.cache = cache
+        # without an issue index every commit with a fix keyword in its message is blamed
+        self.issue_index = IssueIndex(repository, self.query, cache) if fix_confirmation == "issues" else None
+        self.index_future = None
+        self.observed_commits = deque()
+
+    def observe(self, commit):
+        """ Starts blaming a fix as soon as its features are extracted, while later commits are still processed """
+        self.observed_commits.append(commit)
+        if self.issue_index is not None and self.index_future is None:
+            self.index_future = self.start_index_refresh()
+        # the commits wait while the issue index downloads in the background
+        if self.index_future is None or self.index_future.done():
+            while self.observed_commits:
+                self.observe_fix(self.observed_commits.popleft())
+
+    def observe_fix(self, commit):
+        if commit.get("file_count") == 1 and self.is_confirmed_fix(commit):
+            self.blame_targets.append((commit.get("sha"), commit.get("files")[0].filename))
+            if len(self.blame_targets) == BLAME_BATCH_SIZE:
+                self.submit_blame(self.blame_targets, self.git_blame_batch, self.blame_targets)
+                self.blame_targets = []
+
+    def submit_blame(self, key, function, *args):
+        if self.executor is None:
+            self.executor = self.create_executor()
+        # the extraction waits for a blame to finish once too many are in flight, a blame finishing between the
+        # count and the wait returns it at once
+        pending = [future for _, future in self.blame_futures if not future.done()]
+        if len(pending) >= MAX_PENDING_BLAMES:
+            wait(pending, return_when=FIRST_COMPLETED)
+        self.blame_futures.append((key, self.executor.submit(function, *args)))
+
+    def create_executor(self):
+        return ThreadPoolExecutor(max_workers=BLAME_WORKERS)
+
+    def start_index_refresh(self):
+        self.issue_index.load()
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = executor.submit(self.issue_index.refresh)
+        executor.shutdown(wait=False)
+        return future
+
+    def get_issue_index(self):
+        """ Returns the refreshed issue index, None if fixes are recognized by their message """
+        if self.issue_index is None:
+            return None
+        if self.index_future is None:
+            self.index_future = self.start_index_refresh()
+        try:
+            self.index_future.result()
+        except Exception as e:
+            # the pages downloaded before the failure are kept, they were requested in the order of their updates
+            print(f"Downloading the closed issues failed, fixes are recognized by their message: {e}")
+            self.issue_index.save()
+            self.issue_index = None
+            return None
+        self.issue_index.save()
+        if len(self.issue_index.bug_issues) == 0:
+            print("No closed issue has a bug label, fixes are recognized by their message")
+            self.issue_index = None
+        return self.issue_index
+
+    def is_confirmed_fix(self, commit):
+        """ Returns whether a commit references a closed bug issue, or has a fix keyword without an issue index """
+        issue_index = self.get_issue_index()
+        if issue_index is None:
+            return is_message_fix(commit.get("message"))
+        return issue_index.find_bug_report(commit.get("message")) is not None
+
+    def get_reported_time(self, commit):
+        """ Returns the creation time of the earliest bug issue a fix references, None without an issue index """
+        issue_index = self.get_issue_index()
+        return None if issue_index is None else issue_index.find_bug_report(commit.get("message"))
+
+    def collect_blames(self):
+        """ Returns the (key, result) pairs of the blames started while the commits were streamed """
+        results = []
+        while self.blame_futures:
+            key, future = self.blame_futures.popleft()
+            results.append((key, future.result()))
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        return results
 
     def mark_fix_and_get_defects(self, commits):
-        print(self.get_rate())
+        print(self.scheduler.describe())
         self.commits = commits
-        fix_defects = set()
         ci_defects = set()
-        too_comprehensive_list = []
         for sha, commit in self.commits.items():
-            if is_message_fix(commit.get("message").lower()):
-                commit.add("is_fix", True)
-                if commit.get("file_count") > 1:
-                    too_comprehensive_list.append(sha)
-                    continue
-                defect = self.find_defect_source(commit)
-                if defect is not None:
-                    fix_defects.add(defect)
-            else:
-                commit.add("is_fix", False)
-        print(self.get_rate())
+            commit.add("is_fix", is_message_fix(commit.get("message")))
+        # the commits still waiting for the issue index are blamed with the rest
+        self.observed_commits.clear()
+        fix_commits = [commit for commit in self.commits.values() if self.is_confirmed_fix(commit)]
+        if self.issue_index is not None:
+            print(f"{len(fix_commits)} commits reference a closed bug issue, "
+                  f"{sum(commit.get('is_fix') for commit in self.commits.values())} have a fix keyword")
+        fix_defects = self.find_fix_defects(fix_commits)
+        print(self.scheduler.describe())
 
         is_previous_fail = False
         for sha, commit in self.commits.items():
@@ -47,9 +145,24 @@ class Detector:
         defect_list = [((sha in fix_defects) or (sha in ci_defects)) for sha in self.commits]
         return defect_list
 
-    def find_defect_source(self, commit):
+    def find_fix_defects(self, fix_commits):
+        fix_defects = set()
+        too_comprehensive_list = []
+        blamed_commits = []
+        for commit in fix_commits:
+            if commit.get("file_count") > 1:
+                too_comprehensive_list.append(commit.get("sha"))
+                continue
+            blamed_commits.append(commit)
+        blames = self.git_blames([(commit.get("sha"), commit.get("files")[0].filename) for commit in blamed_commits])
+        for commit in blamed_commits:
+            defect = self.find_defect_source(commit, blames[(commit.get("sha"), commit.get("files")[0].filename)])
+            if defect is not None:
+                fix_defects.add(defect)
+        return fix_defects
+
+    def find_defect_source(self, commit, blame_list):
         # scan backwards to find possible defects: no defect can have been fixed before it was introduced
-        blame_list = self.git_blame(commit.get("sha"), commit.get("files")[0].filename)
         overwrite_distribution = {}
         previous_blame_sha = None
         blame_score = 0  # blame_score is double the count of lines changed in a range (always an integer)
@@ -75,55 +188,72 @@ class Detector:
             overwrite_distribution.pop(commit.get("sha"))
         else:
             print(f"Commit {commit.get('sha')} was not a part of its own blame")
+        reported_time = self.get_reported_time(commit)
+        if reported_time is not None:
+            # like in the original SZZ, a defect was committed before its bug was reported
+            commit_times = {blame["commit"]["oid"]: get_timestamp(blame["commit"]["committedDate"])
+                            for blame in blame_list}
+            for blame_sha in [blame_sha for blame_sha in overwrite_distribution
+                              if commit_times[blame_sha] > reported_time]:
+                overwrite_distribution.pop(blame_sha)
         if len(overwrite_distribution) == 0:
             return None
         return max(overwrite_distribution, key=overwrite_distribution.get)
 
-    def git_blame(self, sha, file):
+    def git_blames(self, blame_targets):
+        """ Returns the blame ranges of each (sha, path), requested in concurrent batches of aliased queries """
+        blames = {}
+        for batch, ranges in self.collect_blames():
+            blames.update(zip(batch, ranges))
+        self.blame_targets = []
+        blame_targets = [target for target in blame_targets if target not in blames]
+        batches = [blame_targets[i:i + BLAME_BATCH_SIZE] for i in range(0, len(blame_targets), BLAME_BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=BLAME_WORKERS) as executor:
+            for batch, ranges in zip(batches, executor.map(self.git_blame_batch, batches)):
+                blames.update(zip(batch, ranges))
+        return blames
+
+    def git_blame_batch(self, blame_targets):
         owner = self.repository.split("/")[0]
         name = self.repository.split("/")[1]
-        query = f"""
-        {{
-            repository(owner: "{owner}", name: "{name}") {{
-                object(expression: "{sha}") {{
+        blame_queries = "".join(f"""
+                blame{i}: object(expression: {json.dumps(sha)}) {{
                     ... on Commit {{
-                        blame(path: "{file}") {{
+                        blame(path: {json.dumps(file)}) {{
                             ranges {{
                                 startingLine
                                 endingLine
                                 commit {{
                                     oid
-                                    message
+                                    committedDate
                                 }}
                             }}
                         }}
                     }}
-                }}
+                }}""" for i, (sha, file) in enumerate(blame_targets))
+        query = f"""
+        {{
+            rateLimit {{
+                cost
+            }}
+            repository(owner: "{owner}", name: "{name}") {{{blame_queries}
             }}
         }}
         """
-        blame = requests.post(
-            "https://api.github.com/graphql",
-            headers={"Authorization": "bearer " + self.token},
-            json={"query": query})
-        return blame.json()["data"]["repository"]["object"]["blame"]["ranges"]
-
-    def get_rate(self):
-        query = """
-        {
-            rateLimit {
-                limit
-                cost
-                remaining
-                resetAt
-            }
-        }
-        """
-        remaining = requests.post(
-            "https://api.github.com/graphql",
-            headers={"Authorization": "bearer " + self.token},
-            json={"query": query})
-        return remaining.json()["data"]["rateLimit"]
+        # the query of a batch counts for each of its fixes in the run report
+        with self.scheduler.profiler.batch([sha for sha, _ in blame_targets], "blame"):
+            repository = self.query(query)["repository"]
+        return [repository[f"blame{i}"]["blame"]["ranges"] for i in range(len(blame_targets))]
+
+    def query(self, query):
+        response = self.scheduler.session.post(self.url, headers={"Authorization": "bearer " + self.token},
+                                               json={"query": query})
+        response.raise_for_status()
+        result = response.json()
+        if "errors" in result or result.get("data") is None:
+            raise Exception(f"The GraphQL query failed: {result.get('errors')}")
+        self.scheduler.add_cost(result["data"])
+        return result["data"]
 
 
 def is_message_fix(msg):
@@ -1,48 +1,126 @@
+import os
 import numpy as np
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
+from itertools import combinations, product
 
-CI_STATES = ["failure", "pending", "success"]
+from feature_store import CI_STATES, FEATURE_LABELS, LOG_FEATURES, INTEGER_FEATURES, to_matrix
+from pooled_model import PooledClassifier, load_pooled_model
+
+SUGGESTION_GRADES = [0.75, 0.5, 0.25, 0]
+MAX_SUGGESTION_CHANGES = 3
+MODEL_VERSION = 1
+DEFAULT_PARAMS = {"max_features": "log2", "max_samples": 0.3}
+PARAM_GRID = {
+    "n_estimators": [100, 200],
+    "max_features": ["log2", "sqrt"],
+    "max_samples": [0.3, 0.6],
+    "max_depth": [None, 10],
+}
+CV_FOLDS = 5
+CV_METRICS = ["accuracy", "precision", "recall", "f1"]
+REFIT_THRESHOLD = 50
+WARM_START_TREES = 20
+MAX_TREES = 300
+MIN_COMMIT_COUNT = 20
+MODEL_MODES = ["local", "pooled", "auto"]
 
 
 class Estimator:
 
-    def __init__(self):
+    def __init__(self, repository=None, model_path=None, refit_threshold=REFIT_THRESHOLD, evaluation="split",
+                 pooled_model_path=None, model_mode="auto"):
         self.clf = None
         self.feature_labels = None
         self.target_feature = None
         self.original_defect_probability = None
+        self.repository = repository
+        self.model_path = model_path
+        self.refit_threshold = refit_threshold
+        self.evaluation = evaluation
+        self.params = DEFAULT_PARAMS
+        self.cv_results = None
+        self.pooled_model_path = pooled_model_path
+        self.model_mode = model_mode
+        self.pooled_model = None
 
-    def estimate(self, commits, defects):
-        clf = RandomForestClassifier(max_features='log2', max_samples=0.3, random_state=42)
-        features = []
-        self.feature_labels = None
-        feature_labels = []
-        for commit in commits.values():
-            instance = []
-            for col in commit.get_all():
-                if col in ["sha", "index", "files", "message"]:
-                    continue
-                if self.feature_labels is None:
-                    feature_labels.append(col)
-                value = commit.get(col)
-                if type(value) in [int, float]:
-                    instance.append(np.log10(value + 1))
-                elif type(value) == bool:
-                    instance.append(value)
-                elif col == "ci_state":
-                    if value in CI_STATES:
-                        instance.append(CI_STATES.index(value))
-                    else:
-                        raise Exception(f"Unknown CI state: {value}")
-                else:
-                    sha = commit.get("sha")
-                    raise Exception(f"Column {col} with value {value} could not be parsed for commit {sha}")
-            features.append(instance)
-            if self.feature_labels is None:
-                self.feature_labels = feature_labels
-            if len(instance) != len(self.feature_labels):
-                raise Exception("Machine learning instance does not have the correct count of labels")
+    def can_estimate(self, commit_count):
+        return commit_count >= MIN_COMMIT_COUNT or self.is_pooled(commit_count)
+
+    def is_pooled(self, commit_count):
+        """ Returns whether the pooled model is used, in auto mode only for repositories with too few commits """
+        if self.model_mode == "local" or (self.model_mode == "auto" and commit_count >= MIN_COMMIT_COUNT):
+            return False
+        if self.pooled_model is None:
+            self.pooled_model = load_pooled_model(self.pooled_model_path)
+        return self.pooled_model is not None
+
+    def estimate(self, commits, defects, is_ancestor=None):
+        """ Scores the newest commit, is_ancestor tells whether a stored model was trained after the commits """
+        features = to_matrix(commits.values())
+        self.feature_labels = FEATURE_LABELS
+        shas = list(commits)
+        model = self.load_model()
+        # the model is only trained up to a commit before the target, a model trained up to the target itself or a
+        # newer commit would be replaced with one of fewer commits
+        if model is not None and model["training_sha"] not in shas[:-1] and is_ancestor is not None \
+                and is_ancestor(shas[-1], model["training_sha"]):
+            print(f"The stored model was trained up to {model['training_sha']}, which is not older than the target, "
+                  f"it is kept and a model of the examined commits is trained without storing it")
+            model = None
+            self.model_path = None
+        self.save_training_set(features[:-1], defects[:-1])
+        if self.is_pooled(len(shas)):
+            clf = PooledClassifier(self.pooled_model, features[:-1], defects[:-1])
+        else:
+            clf = self.get_model(features, defects, shas, model)
+        self.score(clf, features[-1])
+        if defects[-1] and self.target_feature[self.feature_labels.index("ci_state")] == CI_STATES.index("failure"):
+            print(f"The commit is probably a defect due to a failing CI")
+
+    def score(self, clf, target_feature):
+        """ Predicts the target commit with a fitted model, the suggestions start from its features """
+        self.clf = clf
+        self.feature_labels = FEATURE_LABELS
+        self.target_feature = target_feature
+        self.original_defect_probability = clf.predict_proba([target_feature])[0][1]
+        print(f"The probability of a defect is {self.original_defect_probability:.2%}")
+
+    def get_model(self, features, defects, shas, model=None):
+        """ Returns the stored model, warm-started with more trees once enough new commits were labeled """
+        # sklearn takes more than a second to import, the pre-push hook scores compiled forests without it
+        from sklearn.ensemble import RandomForestClassifier
+
+        if model is not None and model["training_sha"] in shas[:-1]:
+            clf = model["clf"]
+            new_commit_count = len(shas) - 2 - shas.index(model["training_sha"])
+            if new_commit_count < self.refit_threshold:
+                print(f"Using the stored model trained up to {model['training_sha']}, "
+                      f"{new_commit_count} new commits were labeled since")
+                if not os.path.isfile(get_forest_path(self.model_path)):
+                    save_forest(clf, get_forest_path(self.model_path), self.repository, model["training_sha"],
+                                self.feature_labels)
+                return clf
+            if clf.n_estimators + WARM_START_TREES <= MAX_TREES:
+                print(f"Adding {WARM_START_TREES} trees to the stored model for {new_commit_count} new commits")
+                clf.set_params(n_estimators=clf.n_estimators + WARM_START_TREES, warm_start=True)
+                clf.fit(features[:-1], defects[:-1])
+                self.save_model(clf, shas[-2])
+                return clf
+        if self.evaluation == "cv":
+            self.cv_results = self.cross_validate(features[:-1], defects[:-1])
+            self.params = select_params(self.cv_results)
+            print(f"Selected the parameters {self.params}")
+        else:
+            self.evaluate(features, defects)
+        clf = RandomForestClassifier(**self.params, random_state=42)
+        clf.fit(features[:-1], defects[:-1])
+        self.save_model(clf, shas[-2])
+        return clf
+
+    def evaluate(self, features, defects):
+        from sklearn.ensemble import RandomForestClassifier
+        from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
+
+        clf = RandomForestClassifier(**self.params, random_state=42)
         target_size = int(len(features) * 0.8)
         train_features, train_labels = features[:target_size], defects[:target_size]
         test_features, test_labels = features[target_size:], defects[target_size:]
@@ -55,35 +133,204 @@ class Estimator:
               f"Precision: {precision_score(test_labels, predictions):.2%} "
               f"Recall: {recall_score(test_labels, predictions):.2%} "
               f"F1: {f1_score(test_labels, predictions):.2%} ")
-        clf.fit(features[:-1], defects[:-1])
-        self.clf = clf
-        self.target_feature = features[-1]
-        self.original_defect_probability = clf.predict_proba([features[-1]])[0][1]
-        print(f"The probability of a defect is {self.original_defect_probability:.2%}")
-        if defects[-1] and features[self.feature_labels.index("ci_state")] == "failure":
-            print(f"The commit is probably a defect due to a failing CI")
+
+    def cross_validate(self, features, defects, param_grid=PARAM_GRID, folds=CV_FOLDS):
+        """ Returns the metrics of every fold of a rolling-origin split for every parameter combination """
+        from joblib import Parallel, delayed
+        from sklearn.model_selection import ParameterGrid, TimeSeriesSplit
+
+        defects = np.array(defects)
+        splits = list(TimeSeriesSplit(n_splits=folds).split(features))
+        grid = list(ParameterGrid(param_grid))
+        jobs = [(params, fold, train, test) for params in grid for fold, (train, test) in enumerate(splits)]
+        print(f"Cross-validating {len(grid)} parameter combinations over {len(splits)} time-ordered folds")
+        metrics = Parallel(n_jobs=-1)(delayed(fit_fold)(params, features[train], defects[train], features[test],
+                                                        defects[test]) for params, _, train, test in jobs)
+        results = [{"params": params, "fold": fold, "train_size": len(train), "test_size": len(test), **fold_metrics}
+                   for (params, fold, train, test), fold_metrics in zip(jobs, metrics)]
+        return results
+
+    def load_model(self):
+        if self.model_path is None or not os.path.isfile(self.model_path):
+            return None
+        import joblib
+
+        model = joblib.load(self.model_path)
+        self.params = model.get("params", DEFAULT_PARAMS)
+        if model["repository"] != self.repository or model["feature_labels"] != self.feature_labels \
+                or model["version"] != MODEL_VERSION:
+            print("The stored model does not match the repository or the features, training a new model")
+            return None
+        return model
+
+    def save_model(self, clf, training_sha):
+        if self.model_path is None:
+            return
+        import joblib
+
+        if os.path.dirname(self.model_path):
+            os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
+        joblib.dump({"version": MODEL_VERSION, "repository": self.repository, "training_sha": training_sha,
+                     "feature_labels": self.feature_labels, "params": self.params, "clf": clf}, self.model_path)
+        save_forest(clf, get_forest_path(self.model_path), self.repository, training_sha, self.feature_labels)
+
+    def save_training_set(self, features, defects):
+        """ Stores the labeled features next to the model, the pooled model is trained on them """
+        if self.model_path is None:
+            return
+        if os.path.dirname(self.model_path):
+            os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
+        np.savez_compressed(os.path.splitext(self.model_path)[0] + ".npz", repository=self.repository,
+                            feature_labels=self.feature_labels, features=features, defects=np.array(defects))
 
     def suggest_improvement(self):
+        """ Returns the feature changes which lower the defect probability of the target commit, best first """
+        moves = self.get_moves()
+        candidates = []
+        for change_count in range(1, MAX_SUGGESTION_CHANGES + 1):
+            for features in combinations(sorted(moves), change_count):
+                if change_count <= 2:
+                    move_lists = [moves[i] for i in features]
+                else:  # larger combinations only take the second grade to keep the candidates in the thousands
+                    move_lists = [[moves[i][min(1, len(moves[i]) - 1)]] for i in features]
+                candidates.extend(product(*move_lists))
+        if len(candidates) == 0:
+            return []
+        candidate_matrix = np.tile(self.target_feature, (len(candidates), 1))
+        for row, candidate in enumerate(candidates):
+            for i, value, _ in candidate:
+                candidate_matrix[row, i] = value
+        probabilities = self.clf.predict_proba(candidate_matrix)[:, 1]
+        change_sizes = np.abs(candidate_matrix - self.target_feature).sum(axis=1)
         suggestions = []
-        suggestion_text = None
-        for i in range(len(self.target_feature)):
-            feature_copy = self.target_feature.copy()
-            if type(feature_copy[i]) in [int, float]:
-                feature_copy[i] -= np.log10(2)  # divide the value in 2: log10(x/2) = log10(x) - log10(2)
-                suggestion_text = f"Create half as many changes for {self.feature_labels[i]}"
-            if type(feature_copy[i]) == bool:
-                feature_copy[i] = not feature_copy[i]
-                suggestion_text = f"Ensure that {self.feature_labels[i]} is {feature_copy[i]}"
-            if self.feature_labels[i] == "ci_state":
-                feature_copy[i] = CI_STATES.index("success")
-                suggestion_text = f"Ensure that the CI results are successful"
-            probability = self.clf.predict_proba([feature_copy])[0][1]
-            suggestions.append((suggestion_text, probability))
-        suggestions.sort(key=(lambda x: x[1]))
-        is_better_suggestion = False
-        for suggestion_text, probability in suggestions:
+        for candidate, probability, size in zip(candidates, probabilities, change_sizes):
             if probability < self.original_defect_probability:
-                is_better_suggestion = True
-                print(f"{suggestion_text}, which lowers defect probability to {probability:.2%}")
-        if not is_better_suggestion:
-            print("There is no suggestion for an improvement")
+                suggestions.append({
+                    "probability": probability,
+                    "changes": [{"feature": self.feature_labels[i], "value": raw_value}
+                                for i, _, raw_value in candidate],
+                    "text": " and ".join(self.describe_change(i, raw_value) for i, _, raw_value in candidate),
+                    "size": size,
+                })
+        # equally good suggestions are ranked by the count and then the size of their changes
+        suggestions.sort(key=lambda suggestion: (suggestion["probability"], len(suggestion["changes"]),
+                                                 suggestion["size"]))
+        return suggestions
+
+    def get_moves(self):
+        """ Maps each feature index to its candidate (index, encoded value, raw value) changes """
+        moves = {}
+        for i, label in enumerate(self.feature_labels):
+            value = self.target_feature[i]
+            if LOG_FEATURES[i]:
+                raw_value = 10 ** value - 1
+                if INTEGER_FEATURES[i]:
+                    raw_value = round(raw_value)
+                    new_values = sorted({int(raw_value * grade) for grade in SUGGESTION_GRADES}, reverse=True)
+                else:
+                    new_values = [raw_value * grade for grade in SUGGESTION_GRADES]
+                moves[i] = [(i, np.log10(new_value + 1), new_value)
+                            for new_value in new_values if new_value < raw_value]
+            elif label == "ci_state" and value != CI_STATES.index("success"):
+                moves[i] = [(i, CI_STATES.index("success"), "success")]
+            elif label == "is_fix":
+                moves[i] = [(i, float(not value), not value)]
+            if len(moves.get(i, [])) == 0:
+                moves.pop(i, None)
+        return moves
+
+    def describe_change(self, i, raw_value):
+        label = self.feature_labels[i]
+        if label == "ci_state":
+            return "ensure that the CI results are successful"
+        if label == "is_fix":
+            return f"ensure that is_fix is {raw_value}"
+        original_value = 10 ** self.target_feature[i] - 1
+        return f"lower {label} from {original_value:.3g} to {raw_value:.3g}"
+
+
+class CompiledForest:
+
+    def __init__(self, path):
+        """ The trees of a stored random forest as flat arrays, scored by NumPy alone """
+        forest = np.load(path, allow_pickle=False)
+        self.repository = str(forest["repository"])
+        self.training_sha = str(forest["training_sha"])
+        self.feature_labels = list(forest["feature_labels"])
+        self.version = int(forest["version"])
+        self.roots = forest["roots"]
+        self.left = forest["left"]
+        self.right = forest["right"]
+        self.feature = forest["feature"]
+        self.threshold = forest["threshold"]
+        self.probability = forest["probability"]
+        self.depth = int(forest["depth"])
+
+    def predict_proba(self, features):
+        # like sklearn, the features are compared as float32 values
+        features = np.asarray(features, dtype=np.float32)
+        rows = np.arange(len(features))
+        # every tree walks all rows at once, leaves point to themselves so finished rows stay in place
+        nodes = np.repeat(self.roots[:, np.newaxis], len(features), axis=1)
+        for _ in range(self.depth):
+            is_left = features[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(is_left, self.left[nodes], self.right[nodes])
+        probabilities = self.probability[nodes].mean(axis=0)
+        return np.column_stack([1 - probabilities, probabilities])
+
+
+def save_forest(clf, path, repository, training_sha, feature_labels):
+    """ Stores the trees of a fitted random forest as the flat arrays of a compiled forest """
+    trees = [estimator.tree_ for estimator in clf.estimators_]
+    offsets = np.cumsum([0] + [tree.node_count for tree in trees[:-1]])
+    left, right, feature, threshold, probability = [], [], [], [], []
+    for tree, offset in zip(trees, offsets):
+        nodes = np.arange(tree.node_count)
+        is_leaf = tree.children_left < 0
+        left.append(np.where(is_leaf, nodes, tree.children_left) + offset)
+        right.append(np.where(is_leaf, nodes, tree.children_right) + offset)
+        feature.append(np.where(is_leaf, 0, tree.feature))
+        threshold.append(tree.threshold)
+        value = tree.value[:, 0, :]
+        probability.append(value[:, 1] / value.sum(axis=1))
+    # np.savez would append .npz to a path, which the pooled model would take for a training set
+    with open(path, "wb") as forest_file:
+        np.savez(forest_file, version=MODEL_VERSION, repository=repository, training_sha=training_sha,
+                 feature_labels=feature_labels, roots=offsets, left=np.concatenate(left),
+                 right=np.concatenate(right), feature=np.concatenate(feature), threshold=np.concatenate(threshold),
+                 probability=np.concatenate(probability), depth=max(tree.max_depth for tree in trees))
+
+
+def get_model_path(model_dir, repository):
+    return os.path.join(model_dir, repository.replace("/", "_") + ".joblib")
+
+
+def get_forest_path(model_path):
+    return os.path.splitext(model_path)[0] + ".forest"
+
+
+def fit_fold(params, train_features, train_labels, test_features, test_labels):
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
+
+    clf = RandomForestClassifier(**params, random_state=42)
+    clf.fit(train_features, train_labels)
+    predictions = clf.predict(test_features)
+    return {
+        "accuracy": accuracy_score(test_labels, predictions),
+        "precision": precision_score(test_labels, predictions, zero_division=0),
+        "recall": recall_score(test_labels, predictions, zero_division=0),
+        "f1": f1_score(test_labels, predictions, zero_division=0),
+    }
+
+
+def select_params(cv_results):
+    """ Returns the parameters with the best mean F1 score over all folds """
+    folds = {}
+    for result in cv_results:
+        folds.setdefault(tuple(sorted(result["params"].items())), []).append(result)
+    best = max(folds.values(), key=lambda results: np.mean([result["f1"] for result in results]))
+    mean = {metric: np.mean([result[metric] for result in best]) for metric in CV_METRICS}
+    print(f"Mean over {len(best)} folds: Accuracy: {mean['accuracy']:.2%} Precision: {mean['precision']:.2%} "
+          f"Recall: {mean['recall']:.2%} F1: {mean['f1']:.2%}")
+    return best[0]["params"]
@@ -0,0 +1,125 @@
+import os
+import json
+import pickle
+import sqlite3
+
+from commit import Commit
+from records import FileRecord
+
+CACHE_VERSION = 6
+CACHE_PATH = os.path.join(".autodp", "cache.sqlite")
+# SQLite limits the variables of a statement
+QUERY_BATCH_SIZE = 500
+
+
+class FeatureCache:
+
+    def __init__(self, path):
+        """ An on-disk store of finished commit features and the adapter history of the newest examined window """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # batch runs write to the same file from several processes
+        self.connection = sqlite3.connect(path, timeout=60)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS commits "
+                                    "(cache_key TEXT, sha TEXT, features TEXT, PRIMARY KEY (cache_key, sha))")
+            # the snapshots of caches before version 4 have no window start and can not be reused
+            if "start_sha" not in [column[1] for column in self.connection.execute("PRAGMA table_info(snapshots)")]:
+                self.connection.execute("DROP TABLE IF EXISTS snapshots")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS snapshots "
+                                    "(cache_key TEXT PRIMARY KEY, start_sha TEXT, head_sha TEXT, state BLOB)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS blames "
+                                    "(repository TEXT, sha TEXT, path TEXT, blame TEXT, "
+                                    "PRIMARY KEY (repository, sha, path))")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS issues "
+                                    "(repository TEXT, number INTEGER, created_at REAL, labels TEXT, "
+                                    "PRIMARY KEY (repository, number))")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS issue_updates "
+                                    "(repository TEXT PRIMARY KEY, updated_at TEXT)")
+
+    def load_snapshot(self, cache_key):
+        """ Returns the oldest and newest commit of the window the history was built from, and the history """
+        row = self.connection.execute("SELECT start_sha, head_sha, state FROM snapshots WHERE cache_key = ?",
+                                      (cache_key,)).fetchone()
+        if row is None:
+            return None, None, None
+        return row[0], row[1], pickle.loads(row[2])
+
+    def load_commits(self, cache_key, shas):
+        """ Returns the cached features of those of the commits which are cached """
+        commits = {}
+        shas = list(shas)
+        for i in range(0, len(shas), QUERY_BATCH_SIZE):
+            batch = shas[i:i + QUERY_BATCH_SIZE]
+            query = f"SELECT sha, features FROM commits WHERE cache_key = ? AND sha IN ({', '.join('?' * len(batch))})"
+            for sha, features in self.connection.execute(query, (cache_key, *batch)):
+                commits[sha] = json.loads(features)
+        return commits
+
+    def save(self, cache_key, commits, start_sha=None, head_sha=None, state=None):
+        """ Stores the features of commits and the history of the window from start_sha to head_sha, if given """
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO commits VALUES (?, ?, ?)",
+                                        [(cache_key, commit.get("sha"), json.dumps(serialize_commit(commit)))
+                                         for commit in commits])
+            if head_sha is not None:
+                self.connection.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?)",
+                                        (cache_key, start_sha, head_sha, pickle.dumps(state)))
+
+    def load_blame(self, repository, sha, path):
+        row = self.connection.execute("SELECT blame FROM blames WHERE repository = ? AND sha = ? AND path = ?",
+                                      (repository, sha, path)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def save_blames(self, repository, blames):
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO blames VALUES (?, ?, ?, ?)",
+                                        [(repository, sha, path, json.dumps(blame))
+                                         for (sha, path), blame in blames.items()])
+
+    def load_issues(self, repository):
+        """ Returns the indexed issues of a repository and the time of their newest update """
+        issues = {number: (created_at, json.loads(labels)) for number, created_at, labels in self.connection.execute(
+            "SELECT number, created_at, labels FROM issues WHERE repository = ?", (repository,))}
+        row = self.connection.execute("SELECT updated_at FROM issue_updates WHERE repository = ?",
+                                      (repository,)).fetchone()
+        return issues, None if row is None else row[0]
+
+    def save_issues(self, repository, issues, updated_at):
+        """ Stores changed issues, None removes an issue which is no longer closed """
+        with self.connection:
+            self.connection.executemany("DELETE FROM issues WHERE repository = ? AND number = ?",
+                                        [(repository, number) for number, issue in issues.items() if issue is None])
+            self.connection.executemany("INSERT OR REPLACE INTO issues VALUES (?, ?, ?, ?)",
+                                        [(repository, number, issue[0], json.dumps(issue[1]))
+                                         for number, issue in issues.items() if issue is not None])
+            self.connection.execute("INSERT OR REPLACE INTO issue_updates VALUES (?, ?)", (repository, updated_at))
+
+    def clear(self, cache_key):
+        with self.connection:
+            self.connection.execute("DELETE FROM commits WHERE cache_key = ?", (cache_key,))
+            self.connection.execute("DELETE FROM snapshots WHERE cache_key = ?", (cache_key,))
+
+
+def get_cache_key(repository, backend):
+    return f"{repository}:{backend}:{CACHE_VERSION}"
+
+
+def serialize_commit(commit):
+    features = commit.get_all()
+    features.pop("index")
+    features["files"] = [[file.filename, file.additions, file.deletions, file.previous_filename]
+                         for file in features["files"]]
+    return features
+
+
+def deserialize_commit(features, commit_count, store=None):
+    commit = Commit(store)
+    commit.add("sha", features.pop("sha"))
+    commit.add("index", commit_count)
+    for key, value in features.items():
+        if key == "files":
+            value = [FileRecord(filename, additions, deletions, previous_filename)
+                     for filename, additions, deletions, previous_filename in value]
+        commit.add(key, value)
+    return commit
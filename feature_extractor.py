@@ -0,0 +1,81 @@
+import math
+
+from file_history import FileHistory
+from records import get_file_records
+
+
+class FeatureExtractor:
+
+    def __init__(self):
+        """ Computes the change, file and experience features of commits in order, from the history before them """
+        self.store = None
+        self.history = FileHistory()
+
+    def add_change_properties(self, gc, commit, author):
+        # the author key is stored with the features, cached commits are replayed into the history with it
+        commit.add("author", author)
+        commit.add("total_experience", self.history.add_commit(author))
+        commit.add("additions", gc.stats.additions)
+        commit.add("deletions", gc.stats.deletions)
+        commit.add("changes", gc.stats.total)
+        self.add_file_properties(gc, commit)
+        self.add_file_exp_properties(commit, author)
+        self.add_entropy(gc, commit)
+
+    def get_author(self, gc):
+        return gc.author
+
+    def add_file_properties(self, gc, commit):
+        files = get_file_records(gc.files)
+        commit.add("file_count", len(files))
+        commit.add("files", files)
+        total_complexity = 0
+        highest_complexity = 0
+        file_ids = []
+        for file in files:
+            if file.previous_filename:
+                self.history.rename(file.previous_filename, file.filename)
+            file_id = self.history.get_file_id(file.filename)
+            file_ids.append(file_id)
+            current_complexity = self.history.change_counts[file_id]
+            total_complexity += current_complexity
+            if current_complexity > highest_complexity:
+                highest_complexity = current_complexity
+        previous_change_count = self.history.count_previous_changes(file_ids) if len(file_ids) > 0 else 0
+        for file_id in file_ids:
+            self.history.add_change(file_id)
+        avg_complexity = 0 if len(files) == 0 else total_complexity / len(files)
+        commit.add("avg_file_complexity", avg_complexity)
+        commit.add("highest_file_complexity", highest_complexity)
+        commit.add("previous_change_count", previous_change_count)
+
+    def add_file_exp_properties(self, commit, author):
+        total_experience = 0
+        lowest_experience = 0
+        lowest_experience_prop = 1
+        files = commit.get("files")
+        for file in files:
+            file_id = self.history.file_ids[file.filename]
+            current_experience = self.history.add_author_change(author, file_id)
+            total_experience += current_experience
+            if current_experience < lowest_experience:
+                lowest_experience = current_experience
+            current_file_complexity = self.history.change_counts[file_id] - 1
+            current_experience_prop = 1 if current_file_complexity == 0 \
+                else current_experience / current_file_complexity
+            if current_experience_prop < lowest_experience_prop:
+                lowest_experience_prop = current_experience_prop
+        avg_experience = 0 if len(files) == 0 else total_experience / len(files)
+        commit.add("avg_experience", avg_experience)
+        commit.add("lowest_experience", lowest_experience)
+        commit.add("lowest_experience_proportion", lowest_experience_prop)
+
+    def add_entropy(self, gc, commit):
+        entropy = 0
+        if gc.stats.total != 0:
+            for file in commit.get("files"):
+                information_ratio = file.changes / gc.stats.total
+                entropy -= information_ratio * math.log2(information_ratio) if information_ratio > 0 else 0
+        else:
+            print(f"Found commit with no changes: {commit.get('sha')}")
+        commit.add("entropy", entropy)
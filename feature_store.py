@@ -0,0 +1,110 @@
+import numpy as np
+
+CI_STATES = ["failure", "pending", "success"]
+# name, storage type and model encoding (None for columns which are not model features) in insertion order
+COLUMNS = [
+    ("sha", object, None),
+    ("index", np.int64, None),
+    ("author", object, None),
+    ("total_experience", np.int64, "log"),
+    ("additions", np.int64, "log"),
+    ("deletions", np.int64, "log"),
+    ("changes", np.int64, "log"),
+    ("file_count", np.int64, "log"),
+    ("files", object, None),
+    ("avg_file_complexity", np.float64, "log"),
+    ("highest_file_complexity", np.int64, "log"),
+    ("previous_change_count", np.int64, "log"),
+    ("avg_experience", np.float64, "log"),
+    ("lowest_experience", np.int64, "log"),
+    ("lowest_experience_proportion", np.float64, "log"),
+    ("entropy", np.float64, "log"),
+    ("ci_count", np.int64, "log"),
+    ("ci_state", np.int8, "ci_state"),
+    ("pending_rate", np.float64, "log"),
+    ("failure_rate", np.float64, "log"),
+    ("message", object, None),
+    ("is_fix", np.bool_, "raw"),
+]
+COLUMN_INDEX = {name: i for i, (name, _, _) in enumerate(COLUMNS)}
+FEATURE_LABELS = [name for name, _, encoding in COLUMNS if encoding is not None]
+FEATURE_COLUMNS = [COLUMN_INDEX[name] for name in FEATURE_LABELS]
+LOG_FEATURES = np.array([COLUMNS[i][2] == "log" for i in FEATURE_COLUMNS])
+INTEGER_FEATURES = np.array([np.issubdtype(COLUMNS[i][1], np.integer) for i in FEATURE_COLUMNS])
+
+
+class FeatureStore:
+
+    def __init__(self, capacity=1):
+        """ Typed columns holding the features of many commits, one row per commit """
+        self.size = 0
+        self.capacity = max(capacity, 1)
+        self.columns = {name: np.zeros(self.capacity, dtype=dtype) for name, dtype, _ in COLUMNS}
+        self.present = np.zeros((self.capacity, len(COLUMNS)), dtype=bool)
+
+    def append(self):
+        if self.size == self.capacity:
+            self.grow(self.capacity * 2)
+        self.size += 1
+        return self.size - 1
+
+    def grow(self, capacity):
+        for name, dtype, _ in COLUMNS:
+            column = np.zeros(capacity, dtype=dtype)
+            column[:self.size] = self.columns[name][:self.size]
+            self.columns[name] = column
+        present = np.zeros((capacity, len(COLUMNS)), dtype=bool)
+        present[:self.size] = self.present[:self.size]
+        self.present = present
+        self.capacity = capacity
+
+    def has(self, row, key):
+        return key in COLUMN_INDEX and self.present[row, COLUMN_INDEX[key]]
+
+    def keys(self, row):
+        return [COLUMNS[i][0] for i in np.flatnonzero(self.present[row])]
+
+    def get(self, row, key):
+        value = self.columns[key][row]
+        if key == "ci_state":
+            return CI_STATES[value]
+        if COLUMNS[COLUMN_INDEX[key]][1] is object:
+            return value
+        return value.item()
+
+    def set(self, row, key, value):
+        if key not in COLUMN_INDEX:
+            raise Exception(f"Unknown feature: {key}")
+        if key == "ci_state":
+            if value not in CI_STATES:
+                raise Exception(f"Unknown CI state: {value}")
+            value = CI_STATES.index(value)
+        self.columns[key][row] = value
+        self.present[row, COLUMN_INDEX[key]] = True
+
+    def unset(self, row, key):
+        self.present[row, COLUMN_INDEX[key]] = False
+        if COLUMNS[COLUMN_INDEX[key]][1] is object:
+            self.columns[key][row] = None
+
+    def matrix(self, rows=None):
+        """ Returns the model encoded float64 feature matrix of the rows, all rows by default """
+        if rows is None:
+            rows = slice(0, self.size)
+        if not self.present[rows][:, FEATURE_COLUMNS].all():
+            raise Exception("Machine learning instance does not have the correct count of labels")
+        values = np.column_stack([self.columns[name][rows] for name in FEATURE_LABELS]).astype(np.float64)
+        values[:, LOG_FEATURES] = np.log10(values[:, LOG_FEATURES] + 1)
+        return values
+
+
+def to_matrix(commits):
+    """ Returns the feature matrix of commit views, reading whole row ranges of a shared store at once """
+    commits = list(commits)
+    store = commits[0].store
+    if any(commit.store is not store for commit in commits):
+        return np.vstack([commit.store.matrix([commit.row]) for commit in commits])
+    rows = np.array([commit.row for commit in commits])
+    if np.array_equal(rows, np.arange(rows[0], rows[0] + len(rows))):
+        return store.matrix(slice(rows[0], rows[0] + len(rows)))
+    return store.matrix(rows)
@@ -0,0 +1,69 @@
+class FileHistory:
+
+    def __init__(self):
+        """ The change and experience history of the examined commits, indexed by stable file ids """
+        self.file_ids = {}
+        self.change_counts = []
+        # the positions in the history of the commits which changed each file, linear in the count of changes
+        self.change_commits = []
+        # the last count which reached each commit, so distinct commits are counted without a set per count
+        self.commit_stamps = []
+        self.stamp = 0
+        self.file_authors = []
+        self.author_experience = {}
+        self.author_file_experience = {}
+        self.commit_count = 0
+
+    def add_commit(self, author):
+        """ Returns the count of earlier commits by the author and counts the current one """
+        experience = self.author_experience.get(author, 0)
+        self.author_experience[author] = experience + 1
+        self.commit_count += 1
+        self.commit_stamps.append(0)
+        return experience
+
+    def rename(self, previous_path, path):
+        if previous_path not in self.file_ids:
+            return
+        file_id = self.file_ids.pop(previous_path)
+        stale_id = self.file_ids.get(path)
+        if stale_id is not None:
+            # authors who only changed the replaced file keep their experience with its path
+            for author in self.file_authors[stale_id]:
+                if (author, file_id) not in self.author_file_experience:
+                    self.author_file_experience[(author, file_id)] = self.author_file_experience[(author, stale_id)]
+                    self.file_authors[file_id].add(author)
+        self.file_ids[path] = file_id
+
+    def get_file_id(self, path):
+        if path not in self.file_ids:
+            self.file_ids[path] = len(self.change_counts)
+            self.change_counts.append(0)
+            self.change_commits.append([])
+            self.file_authors.append(set())
+        return self.file_ids[path]
+
+    def add_change(self, file_id):
+        """ Returns the count of earlier changes of the file and counts the current commit """
+        change_count = self.change_counts[file_id]
+        self.change_counts[file_id] = change_count + 1
+        self.change_commits[file_id].append(self.commit_count - 1)
+        return change_count
+
+    def count_previous_changes(self, file_ids):
+        """ Returns the count of distinct earlier commits which changed any of the files """
+        self.stamp += 1
+        count = 0
+        for file_id in file_ids:
+            for position in self.change_commits[file_id]:
+                if self.commit_stamps[position] != self.stamp:
+                    self.commit_stamps[position] = self.stamp
+                    count += 1
+        return count
+
+    def add_author_change(self, author, file_id):
+        """ Returns the count of earlier changes of the file by the author and counts the current one """
+        experience = self.author_file_experience.get((author, file_id), 0)
+        self.author_file_experience[(author, file_id)] = experience + 1
+        self.file_authors[file_id].add(author)
+        return experience
@@ -0,0 +1,109 @@
+import os
+import base64
+import subprocess
+from urllib.parse import urlsplit
+
+from records import FileRecord
+
+COMMIT_MARKER = "\x01"
+
+
+class LocalClone:
+
+    def __init__(self, token, repository, clone_path, api_url=None):
+        """ A bare clone of a GitHub repository, on the host of the API endpoint if one is given """
+        self.token = token
+        self.repository = repository
+        self.clone_path = clone_path
+        self.url = get_clone_url(api_url, repository) if repository else None
+
+    def update(self):
+        if os.path.isdir(self.clone_path):
+            print(f"Fetching {self.repository} into {self.clone_path}")
+            # clones of earlier versions stored the token in the URL of the remote
+            self.git("remote", "set-url", "origin", self.url)
+            self.git("fetch", "--force", "--prune", "origin", "+refs/heads/*:refs/heads/*",
+                     env=self.get_environment())
+        else:
+            print(f"Cloning {self.repository} into {self.clone_path}")
+            subprocess.run(["git", "clone", "--bare", "--quiet", self.url, self.clone_path], check=True,
+                           env=self.get_environment())
+
+    def get_environment(self):
+        # the token is passed in the environment of the command, in the URL it would be stored in the config of the
+        # clone and appear in the error messages
+        if not self.token:
+            return None
+        credentials = base64.b64encode(f"x-access-token:{self.token}".encode()).decode()
+        return {**os.environ, "GIT_CONFIG_COUNT": "1", "GIT_CONFIG_KEY_0": "http.extraheader",
+                "GIT_CONFIG_VALUE_0": f"Authorization: Basic {credentials}"}
+
+    def count_commits(self, target):
+        return int(self.git("rev-list", "--count", target).strip())
+
+    def read_commits(self, target, count):
+        """ Returns (sha, author email, message, files) of the newest count commits, newest first """
+        return self.log(f"--max-count={count}", target)
+
+    def read_listed_commits(self, shas):
+        """ Returns (sha, author email, message, files) of exactly the given commits, in the given order """
+        return self.log("--no-walk=unsorted", *shas)
+
+    def read_commit_times(self, shas):
+        """ Returns the committer time of each commit in seconds since the epoch """
+        times = self.git("show", "--no-patch", "--format=%H %ct", *shas)
+        return {sha: int(time) for sha, time in (line.split() for line in times.splitlines() if line)}
+
+    def is_ancestor(self, ancestor_sha, sha):
+        # merge-base exits with 1 for a commit which is not an ancestor and with 128 for an unknown commit
+        result = subprocess.run(["git", "--git-dir", self.clone_path, "merge-base", "--is-ancestor", ancestor_sha, sha],
+                                capture_output=True)
+        return result.returncode == 0
+
+    def log(self, *args):
+        log = self.git("log", "-z", "--numstat", "-M", "--diff-merges=first-parent",
+                       f"--format={COMMIT_MARKER}%H%x00%aE%x00%B", *args)
+        return [parse_commit(chunk) for chunk in log.split(COMMIT_MARKER) if chunk]
+
+    def git(self, *args, env=None):
+        result = subprocess.run(["git", "--git-dir", self.clone_path, *args],
+                                check=True, capture_output=True, encoding="utf-8", errors="replace", env=env)
+        return result.stdout
+
+
+def get_clone_url(api_url, repository):
+    """ Returns the git URL of a repository on the host of an API endpoint like https://api.github.com """
+    host = "github.com"
+    scheme = "https"
+    if api_url:
+        url = urlsplit(api_url)
+        # GitHub serves its API from a subdomain, GitHub Enterprise from a path of the same host
+        host = url.netloc[len("api."):] if url.netloc.startswith("api.") else url.netloc
+        scheme = url.scheme
+    return f"{scheme}://{host}/{repository}.git"
+
+
+def parse_commit(chunk):
+    fields = chunk.split("\0")
+    sha, author, message = fields[0], fields[1].lower(), fields[2].rstrip("\n")
+    return sha, author, message, parse_numstat(fields[3:])
+
+
+def parse_numstat(fields):
+    """ Returns the file records of the NUL separated fields of git log or git diff -z --numstat """
+    files = []
+    stat_fields = iter(fields)
+    for stat in stat_fields:
+        stat = stat.lstrip("\n")
+        if not stat:
+            continue
+        additions, deletions, filename = stat.split("\t", 2)
+        # binary files are listed with "-" and count as no changes, like in the REST API
+        additions = 0 if additions == "-" else int(additions)
+        deletions = 0 if deletions == "-" else int(deletions)
+        if filename:
+            files.append(FileRecord(filename, additions, deletions))
+        else:  # renames are followed by the previous and the new filename
+            previous_filename = next(stat_fields)
+            files.append(FileRecord(next(stat_fields), additions, deletions, previous_filename))
+    return files
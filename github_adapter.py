@@ -1,168 +1,285 @@
-import math
-import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import github.Commit
 from github import Github, GithubException
 
 from commit import Commit
+from feature_cache import get_cache_key, deserialize_commit
+from feature_extractor import FeatureExtractor
+from feature_store import FeatureStore
+from rate_limit import RateLimitScheduler
+from records import (get_file_records, FileRecord, CommitRecord, StatsRecord, CiRecord, CombinedStatusRecord,
+                     CheckRunRecord, CheckRunsRecord)
 
+API_URL = "https://api.github.com"
 COMMIT_LIMIT = 500
+LISTING_PAGE_SIZE = 100
+PREFETCH_SIZE = 32
+PREFETCH_WORKERS = 8
+# the newest commits whose CI was pending or missing when they were cached get their CI requested again
+CI_SETTLE_COUNT = 50
+CI_FEATURES = ["ci_count", "ci_state", "pending_rate", "failure_rate"]
 
 
-class GithubAdapter:
-    file_exp_history = {}
-    file_history = {}
-    exp_history = {}
-    file_detailed_history = {}
+class GithubAdapter(FeatureExtractor):
+    backend = "github"
 
-    def __init__(self, token, repository, commit_sha):
-        self.g = Github(token)
+    def __init__(self, token, repository, commit_sha, cache=None, scheduler=None, api_url=API_URL,
+                 commit_limit=COMMIT_LIMIT):
+        super().__init__()
+        self.scheduler = scheduler if scheduler is not None else RateLimitScheduler()
+        self.scheduler.install()
+        self.g = Github(token, base_url=api_url, per_page=LISTING_PAGE_SIZE)
+        self.commit_limit = commit_limit
         self.repo = self.g.get_repo(repository)
         self.final_commit_sha = commit_sha
+        self.cache = cache
+        self.cache_key = get_cache_key(repository, self.backend)
         print(f"Running defect prediction for commit {commit_sha}")
 
     def get_features(self):
-        features = {}
-        print(self.g.get_rate_limit())
+        return {commit.get("sha"): commit for commit in self.iter_features()}
+
+    def iter_features(self):
+        """ Yields the features of each commit, oldest first, while the details of the next commits download """
+        print(self.scheduler.describe())
+        # commits are dropped once they are processed, their raw API payloads hold the full patches
+        github_commits = deque(self.get_commits())
+        shas = [github_commit.sha for github_commit in github_commits]
+        self.store = FeatureStore(len(github_commits))
+        cached_commits, restored_count, is_older = self.load_cache(shas)
+        profiler = self.scheduler.profiler
+        if self.cache is not None:
+            profiler.record_cache("commits", len(cached_commits), len(shas) - len(cached_commits))
+        new_commits = []
+        replayed_commits = []
+        refreshed_commits = []
+        refreshed_count = 0
+        commit_count = 0
+        # the history counters need the commits in order, so only their downloads run ahead in a bounded window
+        prefetched = deque()
+        with ThreadPoolExecutor(max_workers=PREFETCH_WORKERS) as executor:
+            while github_commits or prefetched:
+                while github_commits and len(prefetched) < PREFETCH_SIZE:
+                    age = len(github_commits)
+                    github_commit = github_commits.popleft()
+                    features = cached_commits.get(github_commit.sha)
+                    if features is None:
+                        prefetched.append((github_commit.sha, False, executor.submit(self.prefetch_commit,
+                                                                                     github_commit)))
+                    elif is_ci_unsettled(features, age):
+                        prefetched.append((github_commit.sha, True, executor.submit(self.prefetch_ci, github_commit)))
+                    else:
+                        prefetched.append((github_commit.sha, True, None))
+                sha, is_cached, future = prefetched.popleft()
+                if is_cached:
+                    features = cached_commits[sha]
+                    ci = future.result() if future is not None else None
+                    if ci is not None:
+                        features.update(self.get_ci_features(ci, sha))
+                        refreshed_count += 1
+                    if commit_count < restored_count:
+                        commit = deserialize_commit(features, commit_count, self.store)
+                    else:
+                        commit = self.replay_commit(features, commit_count)
+                        replayed_commits.append(commit)
+                    if ci is not None and commit_count < restored_count:
+                        refreshed_commits.append(commit)
+                    profiler.mark_cached(sha)
+                else:
+                    github_commit = future.result()
+                    with profiler.commit(sha, "extract"):
+                        commit = self.create_commit(github_commit, commit_count)
+                    new_commits.append(commit)
+                commit_count += 1
+                yield commit
+        if self.cache is not None:
+            print(f"Reused {len(cached_commits)} cached commits, {len(replayed_commits)} of them replayed into the "
+                  f"history of this window and {refreshed_count} with refreshed CI results, processed "
+                  f"{len(new_commits)} new commits")
+            # the cache stays with the newer head when an older target is examined
+            if not is_older and len(new_commits) + len(replayed_commits) > 0:
+                self.cache.save(self.cache_key, new_commits + replayed_commits + refreshed_commits, shas[0],
+                                shas[-1], self.get_history_state())
+            elif not is_older and len(refreshed_commits) > 0:
+                self.cache.save(self.cache_key, refreshed_commits)
+        print(self.scheduler.describe())
+
+    def load_cache(self, shas):
+        """
+        Returns the cached features of the examined commits, how many of the oldest of them the cached history
+        covers and whether the target is older than the cached head.
+
+        The history features of a commit depend on the oldest commit of the examined window, the snapshot of the
+        history is only restored for the window it was built from. The cached commits of another window, after the
+        window slid or for an older target, are replayed into the history without any request.
+        """
+        if self.cache is None:
+            return {}, 0, False
+        start_sha, head_sha, state = self.cache.load_snapshot(self.cache_key)
+        if head_sha is None:
+            return {}, 0, False
+        is_older = False
+        if head_sha not in shas:
+            is_older = self.is_ancestor(shas[-1], head_sha)
+            if not is_older and not self.is_ancestor(head_sha, shas[-1]):
+                print(f"The cached head {head_sha} is neither before nor after the target, the history was "
+                      f"rewritten, rebuilding the cache")
+                self.cache.clear(self.cache_key)
+                return {}, 0, False
+        cached_commits = self.cache.load_commits(self.cache_key, shas)
+        if start_sha == shas[0] and head_sha in shas \
+                and all(sha in cached_commits for sha in shas[:shas.index(head_sha) + 1]):
+            self.set_history_state(state)
+            return cached_commits, shas.index(head_sha) + 1, False
+        if is_older:
+            print(f"The target is older than the cached head {head_sha}, the cache is left as it is")
+        elif len(cached_commits) > 0:
+            print("The examined window starts at another commit than the cached one, the cached commits are "
+                  "replayed into its history")
+        return cached_commits, 0, is_older
+
+    def is_ancestor(self, ancestor_sha, sha):
+        try:
+            return self.repo.compare(ancestor_sha, sha).status in ["ahead", "identical"]
+        except GithubException as e:
+            # the cached head of a rewritten history can be gone from the repository
+            if e.status == 404:
+                return False
+            raise
+
+    def replay_commit(self, features, commit_count):
+        """ Recomputes the history features of a cached commit, its change and CI features are reused """
+        files = [FileRecord(filename, additions, deletions, previous_filename)
+                 for filename, additions, deletions, previous_filename in features["files"]]
+        gc = CommitRecord(features["sha"], features["author"], features["message"], files,
+                          stats=StatsRecord(features["additions"], features["deletions"]))
+        commit = Commit(self.store)
+        commit.add("sha", gc.sha)
+        commit.add("index", commit_count)
+        self.add_change_properties(gc, commit, features["author"])
+        for key in CI_FEATURES:
+            commit.add(key, features[key])
+        commit.add("message", gc.commit.message)
+        return commit
+
+    def get_history_state(self):
+        return self.history
+
+    def set_history_state(self, state):
+        self.history = state
+
+    def get_commits(self):
+        """ Returns the commits to examine, oldest first """
         if self.final_commit_sha:
             repo_head = self.repo.get_commits(self.final_commit_sha)
         else:
             repo_head = self.repo.get_commits()
         repo_commit_count = repo_head.totalCount
-        commit_count_to_examine = min(repo_commit_count, COMMIT_LIMIT)
+        commit_count_to_examine = min(repo_commit_count, self.commit_limit)
         print(f"{commit_count_to_examine} commits will be examined "
-              f"(Actual: {repo_commit_count}, Limit: {COMMIT_LIMIT})")
-        commit_count = 0
-        for github_commit in list(repo_head[:commit_count_to_examine]).__reversed__():
-            commit = self.create_commit(github_commit, commit_count)
-            features[commit.get("sha")] = commit
-            commit_count += 1
-        print(self.g.get_rate_limit())
-        return features
+              f"(Actual: {repo_commit_count}, Limit: {self.commit_limit})")
+        return list(repo_head[:commit_count_to_examine]).__reversed__()
+
+    def prefetch_ci(self, gc):
+        """ Downloads the CI results of a cached commit whose CI had not settled, on a worker thread """
+        with self.scheduler.profiler.commit(gc.sha, "prefetch"):
+            try:
+                return fetch_ci(gc)
+            except GithubException as e:
+                # the cached CI results are kept and requested again on the next run
+                print(f"Refreshing the CI results of commit {gc.sha} failed: {e}")
+                return None
+
+    def get_ci_source(self, sha):
+        # a lazy PyGithub commit only requests the status and check run endpoints instead of the whole commit
+        return github.Commit.Commit(self.repo._requester, {},
+                                    {"sha": sha, "url": f"{self.repo.url}/commits/{sha}"}, completed=False)
+
+    def prefetch_commit(self, gc):
+        """ Downloads the details and CI results of a commit into records, on a worker thread """
+        with self.scheduler.profiler.commit(gc.sha, "prefetch"):
+            return self.fetch_commit(gc)
+
+    def fetch_commit(self, gc):
+        try:
+            if isinstance(gc, CommitRecord):
+                if not isinstance(gc.ci_source, CiRecord):
+                    gc.ci_source = fetch_ci(gc.ci_source)
+                return gc
+            return CommitRecord(gc.sha, gc.author, gc.commit.message, get_file_records(gc.files), fetch_ci(gc),
+                                StatsRecord(gc.stats.additions, gc.stats.deletions))
+        except GithubException as e:
+            # create_commit requests the commit again on the extraction thread
+            print(f"Prefetching commit {gc.sha} failed: {e}")
+            return gc
 
     def create_commit(self, gc, commit_count):
-        commit = Commit()
+        commit = Commit(self.store)
         commit.add("sha", gc.sha)
         commit.add("index", commit_count)
-        if gc.author not in self.exp_history:
-            self.exp_history[gc.author] = 0
-        commit.add("total_experience", self.exp_history[gc.author])
-        self.exp_history[gc.author] += 1
-        commit.add("additions", gc.stats.additions)
-        commit.add("deletions", gc.stats.deletions)
-        commit.add("changes", gc.stats.total)
-        self.add_file_properties(gc, commit)
-        self.add_file_exp_properties(gc, commit)
-        self.add_entropy(gc, commit)
+        self.add_change_properties(gc, commit, self.get_author(gc))
         self.add_ci_properties(gc, commit)
         commit.add("message", gc.commit.message)
         return commit
 
-    def add_file_properties(self, gc, commit):
-        commit.add("file_count", len(gc.files))
-        commit.add("files", gc.files)
-        total_complexity = 0
-        highest_complexity = 0
-        previous_changes = set()
-        for file in gc.files:
-            if file.previous_filename and file.previous_filename in self.file_history:
-                self.file_history[file.filename] = self.file_history.pop(file.previous_filename)
-                self.file_detailed_history[file.filename] = self.file_detailed_history.pop(file.previous_filename)
-                for author in self.file_exp_history:
-                    author_experience = self.file_exp_history[author]
-                    if file.previous_filename in author_experience:
-                        author_experience[file.filename] = author_experience.pop(file.previous_filename)
-            if file.filename not in self.file_history:
-                self.file_history[file.filename] = 0
-                self.file_detailed_history[file.filename] = []
-            current_complexity = self.file_history[file.filename]
-            total_complexity += current_complexity
-            if current_complexity > highest_complexity:
-                highest_complexity = current_complexity
-            previous_changes = previous_changes.union(self.file_detailed_history[file.filename])
-            self.file_history[file.filename] += 1
-            self.file_detailed_history[file.filename].append(gc.sha)
-        avg_complexity = 0 if len(gc.files) == 0 else total_complexity / len(gc.files)
-        commit.add("avg_file_complexity", avg_complexity)
-        commit.add("highest_file_complexity", highest_complexity)
-        commit.add("previous_change_count", len(previous_changes))
-
-    def add_file_exp_properties(self, gc, commit):
-        total_experience = 0
-        lowest_experience = 0
-        lowest_experience_prop = 1
-        for file in gc.files:
-            if gc.author not in self.file_exp_history:
-                self.file_exp_history[gc.author] = {}
-            if file.filename not in self.file_exp_history[gc.author]:
-                self.file_exp_history[gc.author][file.filename] = 0
-            current_experience = self.file_exp_history[gc.author][file.filename]
-            total_experience += current_experience
-            if current_experience < lowest_experience:
-                lowest_experience = current_experience
-            self.file_exp_history[gc.author][file.filename] += 1
-            current_file_complexity = self.file_history[file.filename] - 1  # TODO: Very dependent on other function!
-            current_experience_prop = 1 if current_file_complexity == 0 \
-                else current_experience / current_file_complexity
-            if current_experience_prop < lowest_experience_prop:
-                lowest_experience_prop = current_experience_prop
-        avg_experience = 0 if len(gc.files) == 0 else total_experience / len(gc.files)
-        commit.add("avg_experience", avg_experience)
-        commit.add("lowest_experience", lowest_experience)
-        commit.add("lowest_experience_proportion", lowest_experience_prop)
-
-    def add_entropy(self, gc, commit):
-        entropy = 0
-        if gc.stats.total != 0:
-            for file in gc.files:
-                information_ratio = file.changes / gc.stats.total
-                entropy -= information_ratio * math.log2(information_ratio) if information_ratio > 0 else 0
-        else:
-            print(f"Found commit with no changes: {commit.get('sha')}")
-        commit.add("entropy", entropy)
+    def get_author(self, gc):
+        # unlinked authors share the None key, accounts are keyed by login so the history can be cached
+        return gc.author.login if gc.author is not None else None
 
     def add_ci_properties(self, gc, commit):
+        for key, value in self.get_ci_features(gc, commit.get("sha")).items():
+            commit.add(key, value)
+
+    def get_ci_features(self, gc, sha):
+        # the scheduler retries the requests failing with server errors and rate limits
         ci_state_dict = {"success": 0, "pending": 0, "failure": 0}
-        attempts = 5
-        success = False
-        for i in range(attempts):
-            try:
-                for status in gc.get_combined_status().statuses:
-                    if status.state in ["success", "fixed"]:
-                        ci_state_dict["success"] += 1
-                    elif status.state in ["pending", "timeout", "running", "queued", "timedout"]:
-                        ci_state_dict["pending"] += 1
-                    elif status.state in ["warning", "canceled", "stale", "infrastructure_fail", "action_required",
-                                          "skipped", "cancelled", "neutral", "retried", "no_tests"]:
-                        ci_state_dict["pending"] += 1  # TODO: Add a warning rate and split it out from pending
-                    elif status.state in ["failure", "error", "failed"]:
-                        ci_state_dict["failure"] += 1
-                    else:
-                        raise Exception(f"Unknown status state: {status.state}")
-                for check_run in gc.get_check_runs():
-                    if check_run.status == "queued":  # queued check runs do not have a conclusion
-                        ci_state_dict["pending"] += 1
-                    elif check_run.conclusion == "success":
-                        ci_state_dict["success"] += 1
-                    elif check_run.conclusion == "pending":
-                        ci_state_dict["pending"] += 1
-                    elif check_run.conclusion == "failure":
-                        ci_state_dict["failure"] += 1
-                    elif check_run.conclusion == "cancelled":
-                        print(f"Uncovered a cancelled CI pipeline for {commit.get('sha')}")
-                    else:
-                        raise Exception(f"Unknown check run state: {check_run.conclusion}")
-                commit.add("ci_count", gc.get_combined_status().total_count + gc.get_check_runs().totalCount)
-                success = True
-            except GithubException as e:
-                print(f"Attempt {i + 1} for commit {commit.get('sha')}: There was a github server error: {e}")
-                time.sleep(i + 1)
-            if success:
-                break
-        if not success:
-            raise Exception(f"Failed to get commit {commit.get('sha')}")
-        commit.add("ci_state", "failure" if ci_state_dict["failure"] > 0
-                               else "pending" if ci_state_dict["pending"] > 0 else "success")
-
-        commit.add("pending_rate", ci_state_dict["pending"] / sum(ci_state_dict.values())
-                   if sum(ci_state_dict.values()) > 0 else 0)
-        commit.add("failure_rate", ci_state_dict["failure"] / (ci_state_dict["success"] + ci_state_dict["failure"])
-                   if ci_state_dict["failure"] > 0 else 0)
+        for status in gc.get_combined_status().statuses:
+            if status.state in ["success", "fixed"]:
+                ci_state_dict["success"] += 1
+            elif status.state in ["pending", "timeout", "running", "queued", "timedout"]:
+                ci_state_dict["pending"] += 1
+            elif status.state in ["warning", "canceled", "stale", "infrastructure_fail", "action_required",
+                                  "skipped", "cancelled", "neutral", "retried", "no_tests"]:
+                ci_state_dict["pending"] += 1  # TODO: Add a warning rate and split it out from pending
+            elif status.state in ["failure", "error", "failed"]:
+                ci_state_dict["failure"] += 1
+            else:
+                raise Exception(f"Unknown status state: {status.state}")
+        for check_run in gc.get_check_runs():
+            if check_run.status == "queued":  # queued check runs do not have a conclusion
+                ci_state_dict["pending"] += 1
+            elif check_run.conclusion == "success":
+                ci_state_dict["success"] += 1
+            elif check_run.conclusion == "pending":
+                ci_state_dict["pending"] += 1
+            elif check_run.conclusion == "failure":
+                ci_state_dict["failure"] += 1
+            elif check_run.conclusion == "cancelled":
+                print(f"Uncovered a cancelled CI pipeline for {sha}")
+            else:
+                raise Exception(f"Unknown check run state: {check_run.conclusion}")
+        return {
+            "ci_count": gc.get_combined_status().total_count + gc.get_check_runs().totalCount,
+            "ci_state": "failure" if ci_state_dict["failure"] > 0
+                        else "pending" if ci_state_dict["pending"] > 0 else "success",
+            "pending_rate": ci_state_dict["pending"] / sum(ci_state_dict.values())
+                            if sum(ci_state_dict.values()) > 0 else 0,
+            "failure_rate": ci_state_dict["failure"] / (ci_state_dict["success"] + ci_state_dict["failure"])
+                            if ci_state_dict["failure"] > 0 else 0,
+        }
+
+
+def is_ci_unsettled(features, age):
+    """ Returns whether the CI of a cached commit can still change, it is pending or missing for a recent commit """
+    return age <= CI_SETTLE_COUNT and (features["ci_count"] == 0 or features["pending_rate"] > 0)
+
+
+def fetch_ci(source):
+    """ Returns the statuses and check runs of a commit as a record """
+    combined_status = source.get_combined_status()
+    check_runs = [CheckRunRecord(check_run.status, check_run.conclusion) for check_run in source.get_check_runs()]
+    # all pages were read, totalCount would request the first page again when there are no check runs
+    return CiRecord(CombinedStatusRecord([status.state for status in combined_status.statuses],
+                                         combined_status.total_count),
+                    CheckRunsRecord(check_runs, len(check_runs)))
@@ -0,0 +1,164 @@
+from git_log import LocalClone
+from github_adapter import GithubAdapter, API_URL, COMMIT_LIMIT
+from rate_limit import RateLimitScheduler
+from records import CommitRecord, StatsRecord, CiRecord, CombinedStatusRecord, CheckRunsRecord, \
+    CheckRunRecord, get_file_records
+
+GRAPHQL_URL = "https://api.github.com/graphql"
+HISTORY_PAGE_SIZE = 100
+CHECK_SUITE_LIMIT = 10
+CHECK_RUN_LIMIT = 50
+STATUS_STATES = {"EXPECTED": "pending"}
+HISTORY_QUERY = f"""
+query($owner: String!, $name: String!, $expression: String!, $cursor: String, $pageSize: Int!) {{
+    rateLimit {{
+        cost
+    }}
+    repository(owner: $owner, name: $name) {{
+        object(expression: $expression) {{
+            ... on Commit {{
+                history(first: $pageSize, after: $cursor) {{
+                    totalCount
+                    pageInfo {{
+                        hasNextPage
+                        endCursor
+                    }}
+                    nodes {{
+                        oid
+                        message
+                        additions
+                        deletions
+                        author {{
+                            user {{
+                                login
+                            }}
+                        }}
+                        status {{
+                            contexts {{
+                                state
+                            }}
+                        }}
+                        checkSuites(first: {CHECK_SUITE_LIMIT}) {{
+                            totalCount
+                            nodes {{
+                                checkRuns(first: {CHECK_RUN_LIMIT}) {{
+                                    totalCount
+                                    nodes {{
+                                        status
+                                        conclusion
+                                    }}
+                                }}
+                            }}
+                        }}
+                    }}
+                }}
+            }}
+        }}
+    }}
+}}
+"""
+
+
+class GraphqlFetcher:
+
+    def __init__(self, token, repository, url=GRAPHQL_URL, scheduler=None):
+        """ Fetches the history, diff stats and CI results of up to 100 commits per GraphQL query """
+        self.token = token
+        self.owner, self.name = repository.split("/")
+        self.url = url
+        self.scheduler = scheduler if scheduler is not None else RateLimitScheduler()
+        self.session = self.scheduler.session
+
+    def fetch_history(self, expression, limit):
+        """ Returns the total commit count and the history nodes of the newest limit commits, newest first """
+        nodes = []
+        cursor = None
+        total_count = None
+        while total_count is None or len(nodes) < min(total_count, limit):
+            page_size = min(HISTORY_PAGE_SIZE, limit - len(nodes))
+            history = self.query(HISTORY_QUERY, {"owner": self.owner, "name": self.name, "expression": expression,
+                                                 "cursor": cursor, "pageSize": page_size})
+            history = history["repository"]["object"]["history"]
+            total_count = history["totalCount"]
+            nodes.extend(history["nodes"])
+            if not history["pageInfo"]["hasNextPage"]:
+                break
+            cursor = history["pageInfo"]["endCursor"]
+        return total_count, nodes
+
+    def query(self, query, variables):
+        response = self.session.post(self.url, headers={"Authorization": "bearer " + self.token},
+                                     json={"query": query, "variables": variables})
+        response.raise_for_status()
+        result = response.json()
+        if "errors" in result:
+            raise Exception(f"The GraphQL query failed: {result['errors']}")
+        self.scheduler.add_cost(result["data"])
+        return result["data"]
+
+
+class GraphqlAdapter(GithubAdapter):
+    backend = "graphql"
+
+    def __init__(self, token, repository, commit_sha, clone_path=None, cache=None, url=GRAPHQL_URL, scheduler=None,
+                 api_url=API_URL, commit_limit=COMMIT_LIMIT):
+        """ Reads commits and CI results in GraphQL batches, files are read from a local clone if one is given """
+        super().__init__(token, repository, commit_sha, cache, scheduler, api_url, commit_limit)
+        self.fetcher = GraphqlFetcher(token, repository, url, self.scheduler)
+        self.clone = LocalClone(token, repository, clone_path, api_url) if clone_path else None
+
+    def get_commits(self):
+        target = self.final_commit_sha if self.final_commit_sha else "HEAD"
+        repo_commit_count, nodes = self.fetcher.fetch_history(target, self.commit_limit)
+        commit_count_to_examine = min(repo_commit_count, self.commit_limit)
+        print(f"{commit_count_to_examine} commits will be examined "
+              f"(Actual: {repo_commit_count}, Limit: {self.commit_limit})")
+        files = self.get_files([node["oid"] for node in nodes])
+        commits = [create_commit_record(node, files.get(node["oid"])) for node in nodes]
+        truncated_commits = [commit for commit in commits if commit.ci_source is None]
+        if len(truncated_commits) > 0:
+            print(f"{len(truncated_commits)} commits have more than {CHECK_SUITE_LIMIT} check suites or "
+                  f"{CHECK_RUN_LIMIT} check runs in a suite, their CI results are requested from the REST API")
+        for commit in truncated_commits:
+            commit.ci_source = self.get_ci_source(commit.sha)
+        return commits.__reversed__()
+
+    def get_files(self, shas):
+        # GraphQL does not list the changed files of a commit, they come from the clone or one REST call per commit
+        if self.clone is None:
+            return {}
+        self.clone.update()
+        return {sha: files for sha, _, _, files in self.clone.read_listed_commits(shas)}
+
+    def fetch_commit(self, gc):
+        if gc.files is None:
+            gc.files = get_file_records(self.repo.get_commit(gc.sha).files)
+        return super().fetch_commit(gc)
+
+    def get_author(self, gc):
+        return gc.author
+
+    def is_ancestor(self, ancestor_sha, sha):
+        if self.clone is None:
+            return super().is_ancestor(ancestor_sha, sha)
+        return self.clone.is_ancestor(ancestor_sha, sha)
+
+
+def create_commit_record(node, files):
+    """ Returns the record of a history node, without a CI source if the query did not return all check runs """
+    author = node["author"]["user"]["login"] if node["author"] and node["author"]["user"] else None
+    # GraphQL enums are the upper case versions of the REST API states, except for expected statuses
+    states = [STATUS_STATES.get(context["state"], context["state"].lower())
+              for context in node["status"]["contexts"]] if node["status"] else []
+    check_runs = []
+    check_run_count = 0
+    for check_suite in node["checkSuites"]["nodes"]:
+        check_run_count += check_suite["checkRuns"]["totalCount"]
+        for check_run in check_suite["checkRuns"]["nodes"]:
+            conclusion = check_run["conclusion"].lower() if check_run["conclusion"] else None
+            check_runs.append(CheckRunRecord(check_run["status"].lower(), conclusion))
+    ci_record = CiRecord(CombinedStatusRecord(states), CheckRunsRecord(check_runs, check_run_count))
+    if node["checkSuites"]["totalCount"] > len(node["checkSuites"]["nodes"]) or len(check_runs) < check_run_count:
+        ci_record = None
+    return CommitRecord(node["oid"], author, node["message"], files, ci_record,
+                        StatsRecord(node["additions"], node["deletions"]))
@@ -0,0 +1,98 @@
+import re
+import json
+from datetime import datetime
+
+ISSUE_PAGE_SIZE = 100
+ISSUE_LABEL_LIMIT = 20
+# "#123" and "GH-123", but not the references to other repositories like "owner/name#123"
+ISSUE_REFERENCE = re.compile(r"(?<![\w/#-])(?:#|GH-)(\d+)\b", re.IGNORECASE)
+BUG_LABEL = re.compile(r"bug|defect|regression|crash", re.IGNORECASE)
+
+
+class IssueIndex:
+
+    def __init__(self, repository, query, cache=None):
+        """ The creation time and labels of the closed issues of a repository by number, refreshed incrementally """
+        self.repository = repository
+        self.query = query
+        self.cache = cache
+        self.issues = {}
+        self.bug_issues = {}
+        self.changed_issues = {}
+        self.updated_at = None
+
+    def refresh(self):
+        """ Downloads the issues updated since the last refresh in pages, all issues the first time """
+        since = self.updated_at
+        cursor = None
+        while True:
+            issues = self.query(self.get_query(since, cursor))["repository"]["issues"]
+            for node in issues["nodes"]:
+                # reopened issues leave the index until they are closed again
+                issue = (get_timestamp(node["createdAt"]), [label["name"] for label in node["labels"]["nodes"]]) \
+                    if node["state"] == "CLOSED" else None
+                self.changed_issues[node["number"]] = issue
+                if issue is None:
+                    self.issues.pop(node["number"], None)
+                else:
+                    self.issues[node["number"]] = issue
+                self.updated_at = max(self.updated_at or node["updatedAt"], node["updatedAt"])
+            if not issues["pageInfo"]["hasNextPage"]:
+                break
+            cursor = issues["pageInfo"]["endCursor"]
+        self.bug_issues = {number: created_at for number, (created_at, labels) in self.issues.items()
+                           if any(BUG_LABEL.search(label) for label in labels)}
+        print(f"Indexed {len(self.issues)} closed issues, {len(self.bug_issues)} of them bugs, "
+              f"{len(self.changed_issues)} were updated since the last refresh")
+
+    def load(self):
+        if self.cache is not None:
+            self.issues, self.updated_at = self.cache.load_issues(self.repository)
+
+    def save(self):
+        # the SQLite connection belongs to the thread which created it, not the one refreshing the index
+        if self.cache is not None and len(self.changed_issues) > 0:
+            self.cache.save_issues(self.repository, self.changed_issues, self.updated_at)
+        self.changed_issues = {}
+
+    def get_query(self, since, cursor):
+        owner, name = self.repository.split("/")
+        since = f", filterBy: {{since: {json.dumps(since)}}}" if since else ""
+        return f"""
+        {{
+            rateLimit {{
+                cost
+            }}
+            repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) {{
+                issues(first: {ISSUE_PAGE_SIZE}, after: {json.dumps(cursor)},
+                       orderBy: {{field: UPDATED_AT, direction: ASC}}{since}) {{
+                    pageInfo {{
+                        hasNextPage
+                        endCursor
+                    }}
+                    nodes {{
+                        number
+                        state
+                        createdAt
+                        updatedAt
+                        labels(first: {ISSUE_LABEL_LIMIT}) {{
+                            nodes {{
+                                name
+                            }}
+                        }}
+                    }}
+                }}
+            }}
+        }}
+        """
+
+    def find_bug_report(self, message):
+        """ Returns the creation time of the earliest bug issue the message references, None if there is none """
+        created_times = [self.bug_issues[number] for number in map(int, ISSUE_REFERENCE.findall(message))
+                         if number in self.bug_issues]
+        return min(created_times) if created_times else None
+
+
+def get_timestamp(date):
+    # GitHub dates are in UTC and end with Z, which fromisoformat only reads since Python 3.11
+    return datetime.fromisoformat(date.replace("Z", "+00:00")).timestamp()
@@ -0,0 +1,231 @@
+import re
+import time
+import codecs
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+from detector import Detector, GRAPHQL_URL
+from git_log import LocalClone
+
+BLAME_FILE_LIMIT = 10
+BLAME_SIZE_LIMIT = 1000000
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+\d+(?:,\d+)? @@")
+BLAME_HEADER = re.compile(r"^([0-9a-f]{40}) \d+ \d+ (\d+)$")
+
+
+class LocalBlameDetector(Detector):
+
+    def __init__(self, token, repository, commit, clone_path, cache=None, url=GRAPHQL_URL,
+                 file_limit=BLAME_FILE_LIMIT, size_limit=BLAME_SIZE_LIMIT, processes=None, scheduler=None,
+                 fix_confirmation="issues"):
+        """ Runs SZZ with git blame on a local clone, blaming the lines each fix changed in its parent """
+        super().__init__(token, repository, commit, url, scheduler, cache, fix_confirmation)
+        self.clone = LocalClone(token, repository, clone_path, url)
+        self.file_limit = file_limit
+        self.size_limit = size_limit
+        self.processes = processes
+        self.blames = {}
+        self.new_blames = {}
+        self.is_clone_updated = False
+
+    def observe_fix(self, commit):
+        if commit.get("file_count") > self.file_limit or not self.is_confirmed_fix(commit):
+            return
+        sha = commit.get("sha")
+        with self.scheduler.profiler.commit(sha, "blame"):
+            paths = self.get_missing_paths(commit)
+        if len(paths) == 0:
+            return
+        if not self.is_clone_updated:
+            self.clone.update()
+            self.is_clone_updated = True
+        self.submit_blame(sha, time_blame_fix, self.clone.clone_path, sha, paths, self.size_limit)
+
+    def create_executor(self):
+        return ProcessPoolExecutor(max_workers=self.processes)
+
+    def find_fix_defects(self, fix_commits):
+        fix_defects = set()
+        too_comprehensive_list = []
+        blamed_commits = []
+        for commit in fix_commits:
+            if commit.get("file_count") > self.file_limit:
+                too_comprehensive_list.append(commit.get("sha"))
+                continue
+            blamed_commits.append(commit)
+        print(f"Blaming {len(blamed_commits)} fixes, {len(too_comprehensive_list)} fixes change more than "
+              f"{self.file_limit} files")
+        self.load_blames(blamed_commits)
+        for commit in blamed_commits:
+            defect = self.find_blamed_defect_source(commit)
+            if defect is not None:
+                fix_defects.add(defect)
+        return fix_defects
+
+    def load_blames(self, commits):
+        for sha, (file_blames, blame_time) in self.collect_blames():
+            self.add_blames(sha, file_blames, blame_time)
+        missing = {}
+        for commit in commits:
+            with self.scheduler.profiler.commit(commit.get("sha"), "blame"):
+                paths = self.get_missing_paths(commit)
+            if len(paths) > 0:
+                missing[commit.get("sha")] = paths
+        if len(missing) > 0:
+            if not self.is_clone_updated:
+                self.clone.update()
+                self.is_clone_updated = True
+            with ProcessPoolExecutor(max_workers=self.processes) as executor:
+                work = [(self.clone.clone_path, sha, paths, self.size_limit) for sha, paths in missing.items()]
+                for (_, sha, _, _), (file_blames, blame_time) in zip(work, executor.map(time_blame_fix, *zip(*work))):
+                    self.add_blames(sha, file_blames, blame_time)
+        if self.cache is not None and len(self.new_blames) > 0:
+            self.cache.save_blames(self.repository, self.new_blames)
+        self.new_blames = {}
+
+    def get_missing_paths(self, commit):
+        """ Returns the changed paths of the commit whose blame is neither loaded nor cached """
+        sha = commit.get("sha")
+        paths = []
+        hits = 0
+        for file in commit.get("files"):
+            if (sha, file.filename) in self.blames:
+                continue
+            blame = self.cache.load_blame(self.repository, sha, file.filename) if self.cache is not None else None
+            if blame is None:
+                paths.append(file.filename)
+            else:
+                self.blames[(sha, file.filename)] = blame
+                hits += 1
+        if self.cache is not None:
+            self.scheduler.profiler.record_cache("blames", hits, len(paths))
+        return paths
+
+    def add_blames(self, sha, file_blames, blame_time):
+        # the blame ran in another process, only its time is recorded for the commit
+        self.scheduler.profiler.record_time([sha], "blame", blame_time)
+        for path, blame in file_blames.items():
+            self.blames[(sha, path)] = blame
+            if blame is not None:
+                self.new_blames[(sha, path)] = blame
+
+    def find_blamed_defect_source(self, commit):
+        """ Returns the commit which wrote most of the lines changed by the fix, over all of its files """
+        overwrite_distribution = {}
+        for file in commit.get("files"):
+            blame = self.blames.get((commit.get("sha"), file.filename))
+            if blame is None:
+                continue
+            for blame_sha, line_count in blame.items():
+                if blame_sha not in overwrite_distribution:
+                    overwrite_distribution[blame_sha] = 0
+                overwrite_distribution[blame_sha] += line_count
+                if blame_sha not in self.commits:
+                    if blame_sha not in self.ignored_commits:
+                        self.ignored_commits[blame_sha] = 0
+                    self.ignored_commits[blame_sha] += 1
+        reported_time = self.get_reported_time(commit)
+        if reported_time is not None and len(overwrite_distribution) > 0:
+            # like in the original SZZ, a defect was committed before its bug was reported
+            commit_times = self.clone.read_commit_times(overwrite_distribution)
+            for blame_sha in [blame_sha for blame_sha in overwrite_distribution
+                              if commit_times[blame_sha] > reported_time]:
+                overwrite_distribution.pop(blame_sha)
+        if len(overwrite_distribution) == 0:
+            return None
+        return max(overwrite_distribution, key=overwrite_distribution.get)
+
+
+def time_blame_fix(clone_path, sha, paths, size_limit):
+    """ Returns the blames of blame_fix and the time they took, in a worker process """
+    start = time.time()
+    return blame_fix(clone_path, sha, paths, size_limit), time.time() - start
+
+
+def blame_fix(clone_path, sha, paths, size_limit):
+    """ Returns the count of changed lines per blamed commit for each path, None for skipped paths """
+    clone = LocalClone(None, None, clone_path)
+    file_blames = {path: {} for path in paths}
+    try:
+        parent = clone.git("rev-parse", "--verify", "--quiet", f"{sha}^").strip()
+    except subprocess.CalledProcessError:  # a root commit can not fix anything
+        return file_blames
+    diff = clone.git("diff", "-U0", "-M", "--no-color", "--no-ext-diff", "--src-prefix=a/", "--dst-prefix=b/",
+                     parent, sha)
+    changed_lines = get_changed_lines(diff, paths)
+    if len(changed_lines) == 0:
+        return file_blames
+    sizes = get_sizes(clone.git("ls-tree", "-l", "-z", parent, "--",
+                                *[old_path for old_path, _ in changed_lines.values()]))
+    for path, (old_path, line_ranges) in changed_lines.items():
+        if old_path not in sizes or len(line_ranges) == 0:  # added files have no blame
+            continue
+        if sizes[old_path] > size_limit:
+            file_blames[path] = None
+            continue
+        if sizes[old_path] == 0:
+            continue
+        line_arguments = [f"-L{start},{end}" for start, end in line_ranges]
+        blame = clone.git("blame", "--incremental", *line_arguments, parent, "--", old_path)
+        file_blames[path] = count_blamed_lines(blame)
+    return file_blames
+
+
+def get_changed_lines(diff, paths):
+    """ Maps each path to its name in the parent and the line ranges the diff removed or inserted next to """
+    changed_lines = {}
+    old_path = None
+    line_ranges = None
+    is_header = False
+    for line in diff.splitlines():
+        if line.startswith("diff --git "):
+            old_path = None
+            line_ranges = None
+            is_header = True
+        elif is_header and line.startswith("--- "):
+            old_path = None if line == "--- /dev/null" else unquote_path(line[4:].rstrip("\t"))[2:]
+        elif is_header and line.startswith("+++ "):
+            path = old_path if line == "+++ /dev/null" else unquote_path(line[4:].rstrip("\t"))[2:]
+            line_ranges = []
+            is_header = False
+            if path in paths and old_path is not None:
+                changed_lines[path] = (old_path, line_ranges)
+        elif line.startswith("@@ ") and line_ranges is not None:
+            match = HUNK_HEADER.match(line)
+            start = int(match.group(1))
+            length = 1 if match.group(2) is None else int(match.group(2))
+            if length > 0:
+                line_ranges.append((start, start + length - 1))
+            else:  # pure insertions blame the line they were inserted after
+                line_ranges.append((max(start, 1), max(start, 1)))
+    return changed_lines
+
+
+def get_sizes(tree):
+    sizes = {}
+    for entry in tree.split("\0"):
+        if not entry:
+            continue
+        info, path = entry.split("\t", 1)
+        size = info.split()[-1]
+        sizes[path] = 0 if size == "-" else int(size)
+    return sizes
+
+
+def count_blamed_lines(blame):
+    line_counts = {}
+    for line in blame.splitlines():
+        match = BLAME_HEADER.match(line)
+        if match:
+            blame_sha = match.group(1)
+            if blame_sha not in line_counts:
+                line_counts[blame_sha] = 0
+            line_counts[blame_sha] += int(match.group(2))
+    return line_counts
+
+
+def unquote_path(path):
+    # git quotes paths with unusual characters like a C string and ends paths with spaces with a tab
+    if path.startswith('"') and path.endswith('"'):
+        return codecs.escape_decode(path[1:-1].encode("utf-8"))[0].decode("utf-8")
+    return path
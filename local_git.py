@@ -0,0 +1,49 @@
+from git_log import LocalClone
+from github_adapter import GithubAdapter, API_URL, COMMIT_LIMIT
+from records import CommitRecord
+
+
+class LocalGitAdapter(GithubAdapter):
+    backend = "local"
+
+    def __init__(self, token, repository, commit_sha, clone_path, cache=None, scheduler=None, api_url=API_URL,
+                 commit_limit=COMMIT_LIMIT):
+        """ Reads commit features from a local bare clone, only the CI properties are requested from GitHub """
+        super().__init__(token, repository, commit_sha, cache, scheduler, api_url, commit_limit)
+        self.clone = LocalClone(token, repository, clone_path, api_url)
+
+    def get_commits(self):
+        self.clone.update()
+        target = self.final_commit_sha if self.final_commit_sha else "HEAD"
+        repo_commit_count = self.clone.count_commits(target)
+        commit_count_to_examine = min(repo_commit_count, self.commit_limit)
+        print(f"{commit_count_to_examine} commits will be examined "
+              f"(Actual: {repo_commit_count}, Limit: {self.commit_limit})")
+        clone_commits = self.clone.read_commits(target, commit_count_to_examine)
+        logins = self.get_logins(commit_count_to_examine)
+        commits = [CommitRecord(sha, self.get_login(logins, sha), message, files, self.get_ci_source(sha))
+                   for sha, _, message, files in clone_commits]
+        return commits.__reversed__()
+
+    def get_logins(self, count):
+        """ Maps the newest commits to the GitHub logins of their authors, read from the commit listing """
+        if self.final_commit_sha:
+            listing = self.repo.get_commits(self.final_commit_sha)
+        else:
+            listing = self.repo.get_commits()
+        return {commit.sha: commit.author.login if commit.author is not None else None
+                for commit in listing[:count]}
+
+    def get_login(self, logins, sha):
+        # the listing and git log can order commits of the same time differently at the end of the window
+        if sha not in logins:
+            author = self.repo.get_commit(sha).author
+            logins[sha] = author.login if author is not None else None
+        return logins[sha]
+
+    def get_author(self, gc):
+        # the experience is keyed by GitHub login like for the API backends, git emails differ between machines
+        return gc.author
+
+    def is_ancestor(self, ancestor_sha, sha):
+        return self.clone.is_ancestor(ancestor_sha, sha)
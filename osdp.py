@@ -1,58 +1,131 @@
 import os
-import csv
-from datetime import datetime
-
-from detector import Detector
-from estimator import Estimator
-from github_adapter import GithubAdapter
-
-TOKEN = os.environ.get("TOKEN", None)
-REPOSITORY = os.environ.get("REPOSITORY", None)
-COMMIT_SHA = os.environ.get("COMMIT_SHA", None)
-if os.path.isfile(".env"):
-    with open(".env") as fp:
-        for line in fp.readlines():
-            line = line.strip().split("=", 1)
-            if TOKEN is None and line[0] == "TOKEN" and line[1]:
-                TOKEN = line[1]
-            if REPOSITORY is None and line[0] == "REPOSITORY" and line[1]:
-                REPOSITORY = line[1]
-            if COMMIT_SHA is None and line[0] == "COMMIT_SHA" and line[1]:
-                COMMIT_SHA = line[1]
-if TOKEN is None:
-    raise Exception("No token could be found")
-if REPOSITORY is None:
-    raise Exception("No repository could be found")
-
-
-def predict_and_suggest():
+
+from detector import Detector, FIX_CONFIRMATIONS
+from estimator import Estimator, REFIT_THRESHOLD, MODEL_MODES, get_model_path
+from feature_cache import FeatureCache, CACHE_PATH
+from github_adapter import GithubAdapter, API_URL, COMMIT_LIMIT
+from graphql_adapter import GraphqlAdapter, GRAPHQL_URL
+from local_blame import LocalBlameDetector, BLAME_FILE_LIMIT, BLAME_SIZE_LIMIT
+from local_git import LocalGitAdapter
+from pipeline import run_pipeline
+from pooled_model import POOLED_MODEL_PATH, MODEL_DIR
+from profiling import Profiler
+from rate_limit import RateLimitScheduler
+from response_cache import ResponseCache
+from settings import read_settings
+
+SETTINGS = {
+    "TOKEN": None,
+    "REPOSITORY": None,
+    "COMMIT_SHA": None,
+    "BACKEND": "github",
+    "LOCAL_CLONE": None,
+    "CACHE_PATH": CACHE_PATH,
+    "RESPONSE_CACHE_PATH": os.path.join(".autodp", "responses.sqlite"),
+    "API_URL": API_URL,
+    "GRAPHQL_URL": GRAPHQL_URL,
+    "COMMIT_LIMIT": COMMIT_LIMIT,
+    "BLAME_BACKEND": "github",
+    "FIX_CONFIRMATION": "issues",
+    "BLAME_FILE_LIMIT": BLAME_FILE_LIMIT,
+    "BLAME_SIZE_LIMIT": BLAME_SIZE_LIMIT,
+    "MODEL_DIR": MODEL_DIR,
+    "MODEL_NAME": None,
+    "REFIT_THRESHOLD": REFIT_THRESHOLD,
+    "EVALUATION": "split",
+    "MODEL_MODE": "auto",
+    "POOLED_MODEL_PATH": POOLED_MODEL_PATH,
+    "REPORT_PATH": os.path.join(".autodp", "report.json"),
+    "PROFILE_PATH": None,
+}
+INTEGER_SETTINGS = ["COMMIT_LIMIT", "BLAME_FILE_LIMIT", "BLAME_SIZE_LIMIT", "REFIT_THRESHOLD"]
+# an empty value turns these off instead of falling back to the default
+OPTIONAL_SETTINGS = ["CACHE_PATH", "RESPONSE_CACHE_PATH", "MODEL_DIR", "POOLED_MODEL_PATH", "REPORT_PATH",
+                     "PROFILE_PATH"]
+
+
+def get_settings(overrides=None):
+    """ Returns the settings from the overrides, the environment, the .env file and the defaults, in this order """
+    settings = read_settings(SETTINGS, overrides, OPTIONAL_SETTINGS)
+    for setting in INTEGER_SETTINGS:
+        settings[setting] = int(settings[setting])
+    if settings["TOKEN"] is None:
+        raise Exception("No token could be found")
+    if settings["REPOSITORY"] is None:
+        raise Exception("No repository could be found")
+    if settings["BACKEND"] not in ["github", "local", "graphql"]:
+        raise Exception(f"Unknown backend: {settings['BACKEND']}")
+    if settings["EVALUATION"] not in ["split", "cv"]:
+        raise Exception(f"Unknown evaluation: {settings['EVALUATION']}")
+    if settings["MODEL_MODE"] not in MODEL_MODES:
+        raise Exception(f"Unknown model mode: {settings['MODEL_MODE']}")
+    if settings["BLAME_BACKEND"] not in ["github", "local"]:
+        raise Exception(f"Unknown blame backend: {settings['BLAME_BACKEND']}")
+    if settings["FIX_CONFIRMATION"] not in FIX_CONFIRMATIONS:
+        raise Exception(f"Unknown fix confirmation: {settings['FIX_CONFIRMATION']}")
+    if (settings["BACKEND"] == "local" or settings["BLAME_BACKEND"] == "local") and not settings["LOCAL_CLONE"]:
+        settings["LOCAL_CLONE"] = get_clone_path(settings["REPOSITORY"])
+    return settings
+
+
+def get_clone_path(repository):
+    return os.path.join(".clones", repository.replace("/", "_") + ".git")
+
+
+def create_adapter(settings, cache, scheduler):
+    token, repository, commit_sha = settings["TOKEN"], settings["REPOSITORY"], settings["COMMIT_SHA"]
+    if settings["BACKEND"] == "local":
+        return LocalGitAdapter(token, repository, commit_sha, settings["LOCAL_CLONE"], cache, scheduler,
+                               settings["API_URL"], settings["COMMIT_LIMIT"])
+    if settings["BACKEND"] == "graphql":
+        return GraphqlAdapter(token, repository, commit_sha, settings["LOCAL_CLONE"], cache, settings["GRAPHQL_URL"],
+                              scheduler, settings["API_URL"], settings["COMMIT_LIMIT"])
+    return GithubAdapter(token, repository, commit_sha, cache, scheduler, settings["API_URL"],
+                         settings["COMMIT_LIMIT"])
+
+
+def create_detector(settings, cache, scheduler):
+    token, repository, commit_sha = settings["TOKEN"], settings["REPOSITORY"], settings["COMMIT_SHA"]
+    if settings["BLAME_BACKEND"] == "local":
+        return LocalBlameDetector(token, repository, commit_sha, settings["LOCAL_CLONE"], cache,
+                                  settings["GRAPHQL_URL"], settings["BLAME_FILE_LIMIT"], settings["BLAME_SIZE_LIMIT"],
+                                  scheduler=scheduler, fix_confirmation=settings["FIX_CONFIRMATION"])
+    return Detector(token, repository, commit_sha, settings["GRAPHQL_URL"], scheduler, cache,
+                    settings["FIX_CONFIRMATION"])
+
+
+def create_estimator(settings):
+    model_dir = settings["MODEL_DIR"]
+    model_name = settings["MODEL_NAME"] if settings["MODEL_NAME"] else settings["REPOSITORY"]
+    model_path = get_model_path(model_dir, model_name) if model_dir else None
+    return Estimator(settings["REPOSITORY"], model_path, settings["REFIT_THRESHOLD"], settings["EVALUATION"],
+                     settings["POOLED_MODEL_PATH"], settings["MODEL_MODE"])
+
+
+def predict_and_suggest(settings=None, budget=None):
+    """ Returns the results of a prediction, a budget shares the rate limits with the other processes of a batch """
     print("Initializing")
-    adaptor = GithubAdapter(TOKEN, REPOSITORY, COMMIT_SHA)
-    detector = Detector(TOKEN, REPOSITORY, COMMIT_SHA)
-    estimator = Estimator()
-
-    print(f"Getting features, {datetime.now()}")
-    features = adaptor.get_features()
-    # flush_debug_csv(features)
-    print(f"Getting defects, {datetime.now()}")
-    defects = detector.mark_fix_and_get_defects(features)
-    if len(features) < 20:
-        print(f"The commit count must at least be 20, found {len(features)}")
-        print(f"Finished, {datetime.now()}")
-        exit(0)
-    print(f"Estimating defect probability, {datetime.now()}")
-    estimator.estimate(features, defects)
-    print(f"Getting improvement suggestions, {datetime.now()}")
-    estimator.suggest_improvement()
-    print(f"Finished, {datetime.now()}")
-
-
-def flush_debug_csv(features):
-    csv_file_name = "debug.csv"
-    with open(csv_file_name, "w", newline='', encoding="utf-8") as csv_file:
-        csv_writer = csv.writer(csv_file)
-        for commit in features.values():
-            csv_writer.writerow(commit.to_list())
+    settings = settings if settings is not None else get_settings()
+    profiler = Profiler(settings["PROFILE_PATH"])
+    result = None
+    try:
+        result = run_stages(settings, profiler, budget)
+        return result
+    finally:
+        profiler.write_report(settings["REPORT_PATH"], repository=settings["REPOSITORY"],
+                              commit_sha=settings["COMMIT_SHA"], backend=settings["BACKEND"],
+                              blame_backend=settings["BLAME_BACKEND"], result=result)
+
+
+def run_stages(settings, profiler, budget=None):
+    cache = FeatureCache(settings["CACHE_PATH"]) if settings["CACHE_PATH"] else None
+    response_cache = ResponseCache(settings["RESPONSE_CACHE_PATH"]) if settings["RESPONSE_CACHE_PATH"] else None
+    scheduler = RateLimitScheduler(profiler, budget, response_cache)
+    with profiler.stage("initialization"):
+        adaptor = create_adapter(settings, cache, scheduler)
+        detector = create_detector(settings, cache, scheduler)
+        estimator = create_estimator(settings)
+    return run_pipeline(profiler, adaptor, detector, estimator)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,56 @@
+import csv
+from datetime import datetime
+
+from estimator import MIN_COMMIT_COUNT, CV_METRICS
+
+SUGGESTION_COUNT = 5
+
+
+def run_pipeline(profiler, adaptor, detector, estimator):
+    """ Runs the stages of a prediction and returns its results, None if there are too few commits for any model """
+    print(f"Getting features, {datetime.now()}")
+    features = {}
+    with profiler.stage("features"):
+        # fixes are blamed while the features of later commits are still extracted
+        for commit in adaptor.iter_features():
+            features[commit.get("sha")] = commit
+            detector.observe(commit)
+    # flush_debug_csv(features)
+    print(f"Getting defects, {datetime.now()}")
+    with profiler.stage("defects"):
+        defects = detector.mark_fix_and_get_defects(features)
+    if not estimator.can_estimate(len(features)):
+        print(f"The commit count must at least be {MIN_COMMIT_COUNT}, found {len(features)}")
+        print(f"Finished, {datetime.now()}")
+        return None
+    print(f"Estimating defect probability, {datetime.now()}")
+    with profiler.stage("estimation"):
+        estimator.estimate(features, defects, adaptor.is_ancestor)
+    print(f"Getting improvement suggestions, {datetime.now()}")
+    with profiler.stage("suggestions"):
+        suggestions = estimator.suggest_improvement()
+    for suggestion in suggestions[:SUGGESTION_COUNT]:
+        # capitalize() would lowercase the feature names in the rest of the text
+        text = suggestion["text"]
+        print(f"{text[:1].upper() + text[1:]}, which lowers defect probability to {suggestion['probability']:.2%}")
+    if len(suggestions) == 0:
+        print("There is no suggestion for an improvement")
+    print(f"Finished, {datetime.now()}")
+    return {
+        "commit_count": len(features),
+        "defect_count": sum(defects),
+        "defect_probability": float(estimator.original_defect_probability),
+        "suggestions": [{"text": suggestion["text"], "probability": float(suggestion["probability"])}
+                        for suggestion in suggestions[:SUGGESTION_COUNT]],
+        # the metrics of every fold and parameter combination with EVALUATION=cv, None otherwise
+        "cross_validation": [{**result, **{metric: float(result[metric]) for metric in CV_METRICS}}
+                             for result in estimator.cv_results] if estimator.cv_results is not None else None,
+    }
+
+
+def flush_debug_csv(features):
+    csv_file_name = "debug.csv"
+    with open(csv_file_name, "w", newline='', encoding="utf-8") as csv_file:
+        csv_writer = csv.writer(csv_file)
+        for commit in features.values():
+            csv_writer.writerow(commit.to_list())
@@ -0,0 +1,145 @@
+import os
+import glob
+import argparse
+import numpy as np
+
+from feature_store import FEATURE_LABELS, LOG_FEATURES
+
+POOLED_MODEL_VERSION = 1
+POOLED_PARAMS = {"n_estimators": 300, "max_features": "sqrt", "min_samples_leaf": 5}
+MIN_TRAINING_COMMITS = 20
+MIN_CALIBRATION_COMMITS = 20
+# the count of commits the pooled statistics weigh against the statistics of a repository
+PRIOR_WEIGHT = 20
+MODEL_DIR = os.path.join(".autodp", "models")
+POOLED_MODEL_PATH = os.path.join(".autodp", "pooled.joblib")
+
+
+class PooledClassifier:
+
+    def __init__(self, model, features, defects):
+        """ The pooled model normalized by the statistics of one repository and calibrated on its labeled commits """
+        # like in the estimator, sklearn is only imported once a model is fitted
+        from sklearn.linear_model import LogisticRegression
+
+        self.model = model
+        self.center, self.scale = get_statistics(features, model["center"], model["scale"])
+        self.calibration = None
+        defect_count = int(np.sum(defects))
+        if len(defects) >= MIN_CALIBRATION_COMMITS and 0 < defect_count < len(defects):
+            scores = self.model["clf"].predict_proba(self.normalize(features))[:, 1]
+            self.calibration = LogisticRegression().fit(get_logits(scores), defects)
+        print(f"Using the pooled model of {len(model['repositories'])} repositories"
+              f"{', calibrated' if self.calibration is not None else ''} on {len(defects)} labeled commits")
+
+    def normalize(self, features):
+        return normalize(features, self.center, self.scale)
+
+    def predict_proba(self, features):
+        probabilities = self.model["clf"].predict_proba(self.normalize(np.asarray(features)))[:, 1]
+        if self.calibration is not None:
+            probabilities = self.calibration.predict_proba(get_logits(probabilities))[:, 1]
+        return np.column_stack([1 - probabilities, probabilities])
+
+
+def get_statistics(features, prior_center, prior_scale):
+    """ Returns the median and interquartile range of each feature, shrunk towards the pooled ones for few commits """
+    if len(features) == 0:
+        return prior_center, prior_scale
+    weight = len(features) / (len(features) + PRIOR_WEIGHT)
+    lower, center, upper = np.percentile(features, [25, 50, 75], axis=0)
+    center = weight * center + (1 - weight) * prior_center
+    scale = weight * (upper - lower) + (1 - weight) * prior_scale
+    scale[scale == 0] = 1
+    return center, scale
+
+
+def normalize(features, center, scale):
+    """ Scales the log encoded features of a repository, the CI state and fix flag keep their values """
+    features = np.array(features, dtype=np.float64)
+    features[:, LOG_FEATURES] = (features[:, LOG_FEATURES] - center[LOG_FEATURES]) / scale[LOG_FEATURES]
+    return features
+
+
+def get_logits(probabilities):
+    probabilities = np.clip(probabilities, 1e-6, 1 - 1e-6)
+    return np.log(probabilities / (1 - probabilities)).reshape(-1, 1)
+
+
+def load_training_sets(paths):
+    training_sets = {}
+    for path in paths:
+        training_set = np.load(path, allow_pickle=False)
+        if list(training_set["feature_labels"]) != FEATURE_LABELS:
+            print(f"Skipping {path}, its features do not match")
+            continue
+        if len(training_set["defects"]) < MIN_TRAINING_COMMITS:
+            print(f"Skipping {path}, it has fewer than {MIN_TRAINING_COMMITS} commits")
+            continue
+        repository = str(training_set["repository"])
+        # a batch stores a training set per listed commit, only the largest one of a repository is kept so every
+        # repository keeps the same weight
+        if repository in training_sets and len(training_sets[repository][2]) >= len(training_set["defects"]):
+            continue
+        training_sets[repository] = (repository, training_set["features"], training_set["defects"])
+    return list(training_sets.values())
+
+
+def train_pooled_model(training_paths, model_path):
+    """ Trains one model on the training sets of many repositories, each normalized by its own statistics """
+    import joblib
+    from sklearn.ensemble import RandomForestClassifier
+
+    training_sets = load_training_sets(training_paths)
+    if len(training_sets) == 0:
+        raise Exception("There are no training sets to train a pooled model on")
+    statistics = [np.percentile(features, [25, 50, 75], axis=0) for _, features, _ in training_sets]
+    prior_center = np.median([center for _, center, _ in statistics], axis=0)
+    prior_scale = np.median([upper - lower for lower, _, upper in statistics], axis=0)
+    prior_scale[prior_scale == 0] = 1
+    features = []
+    defects = []
+    weights = []
+    for _, repository_features, repository_defects in training_sets:
+        center, scale = get_statistics(repository_features, prior_center, prior_scale)
+        features.append(normalize(repository_features, center, scale))
+        defects.append(repository_defects)
+        # every repository has the same weight, large repositories do not dominate the pooled model
+        weights.append(np.full(len(repository_defects), 1 / len(repository_defects)))
+    features = np.vstack(features)
+    defects = np.concatenate(defects)
+    weights = np.concatenate(weights) * len(defects) / len(training_sets)
+    clf = RandomForestClassifier(**POOLED_PARAMS, n_jobs=-1, random_state=42)
+    clf.fit(features, defects, sample_weight=weights)
+    if os.path.dirname(model_path):
+        os.makedirs(os.path.dirname(model_path), exist_ok=True)
+    repositories = [repository for repository, _, _ in training_sets]
+    joblib.dump({"version": POOLED_MODEL_VERSION, "feature_labels": FEATURE_LABELS, "repositories": repositories,
+                 "center": prior_center, "scale": prior_scale, "clf": clf}, model_path)
+    print(f"Trained the pooled model on {len(defects)} commits of {len(repositories)} repositories, "
+          f"saved it to {model_path}")
+
+
+def load_pooled_model(model_path):
+    if not model_path or not os.path.isfile(model_path):
+        return None
+    import joblib
+
+    model = joblib.load(model_path)
+    if model["version"] != POOLED_MODEL_VERSION or model["feature_labels"] != FEATURE_LABELS:
+        print("The pooled model does not match the features, train it again")
+        return None
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trains the pooled model from the training sets stored next to the "
+                                                 "models of the repositories")
+    parser.add_argument("--models", default=MODEL_DIR, help="the MODEL_DIR of the repository runs")
+    parser.add_argument("--output", default=POOLED_MODEL_PATH, help="the POOLED_MODEL_PATH of the pooled model")
+    arguments = parser.parse_args()
+    train_pooled_model(sorted(glob.glob(os.path.join(arguments.models, "*.npz"))), arguments.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+from commit import Commit
+from estimator import Estimator, CompiledForest, MODEL_VERSION, get_model_path, get_forest_path
+from feature_cache import FeatureCache, CACHE_PATH, get_cache_key
+from feature_extractor import FeatureExtractor
+from feature_store import FeatureStore, FEATURE_LABELS
+from git_log import parse_numstat
+from pipeline import SUGGESTION_COUNT
+from pooled_model import MODEL_DIR
+from records import CommitRecord
+from settings import read_settings
+
+# only the settings to find the cached history and model, the hook needs no token
+HOOK_SETTINGS = {
+    "REPOSITORY": None,
+    "BACKEND": "github",
+    "AUTHOR": None,
+    "CACHE_PATH": CACHE_PATH,
+    "MODEL_DIR": MODEL_DIR,
+}
+OPTIONAL_SETTINGS = ["CACHE_PATH", "MODEL_DIR"]
+GITHUB_REMOTE = re.compile(r"github\.com[:/](?P<repository>[^/]+/[^/]+?)(?:\.git)?/?$")
+
+
+class DiffExtractor(FeatureExtractor):
+
+    def __init__(self, history):
+        """ Computes the features of an uncommitted diff as the next commit after a cached history """
+        super().__init__()
+        self.history = history
+        self.store = FeatureStore()
+
+    def create_commit(self, diff, is_fix):
+        commit = Commit(self.store)
+        commit.add("sha", diff.sha)
+        commit.add("index", 0)
+        self.add_change_properties(diff, commit, self.get_author(diff))
+        # a diff has no CI results yet, it is scored like a commit without any CI
+        commit.add("ci_count", 0)
+        commit.add("ci_state", "success")
+        commit.add("pending_rate", 0)
+        commit.add("failure_rate", 0)
+        commit.add("message", diff.commit.message)
+        commit.add("is_fix", is_fix)
+        return commit
+
+
+def score_diff(settings, staged=False, base="HEAD", message=""):
+    """ Returns the defect probability of the working tree or staged diff, None if there is nothing to score """
+    repository = settings["REPOSITORY"] or get_remote_repository()
+    if repository is None:
+        print("No repository could be found, set REPOSITORY")
+        return None
+    files = parse_numstat(git("diff", "-z", "--numstat", "-M", *(["--cached"] if staged else []), base).split("\0"))
+    if len(files) == 0:
+        print("There are no changes to score")
+        return None
+    history = load_history(settings["CACHE_PATH"], repository, settings["BACKEND"])
+    forest = load_forest(settings["MODEL_DIR"], repository)
+    if history is None or forest is None:
+        return None
+    author = settings["AUTHOR"] or get_author()
+    if author is None:
+        print("No author could be found, set AUTHOR to the GitHub login, the experience features are unknown")
+    diff = CommitRecord("working tree" if not staged else "index", author, message, files)
+    commit = DiffExtractor(history).create_commit(diff, is_fix(message))
+    print(f"Scoring {len(files)} changed files against {base}")
+    estimator = Estimator(repository)
+    estimator.score(forest, commit.store.matrix([commit.row])[0])
+    suggestions = estimator.suggest_improvement()
+    for suggestion in suggestions[:SUGGESTION_COUNT]:
+        # capitalize() would lowercase the feature names in the rest of the text
+        text = suggestion["text"]
+        print(f"{text[:1].upper() + text[1:]}, which lowers defect probability to {suggestion['probability']:.2%}")
+    if len(suggestions) == 0:
+        print("There is no suggestion for an improvement")
+    return estimator.original_defect_probability
+
+
+def load_history(cache_path, repository, backend):
+    """ Returns the file history after the newest cached commit of a full run """
+    if not cache_path or not os.path.isfile(cache_path):
+        print(f"There is no feature cache at {cache_path}, run osdp.py first")
+        return None
+    _, head_sha, history = FeatureCache(cache_path).load_snapshot(get_cache_key(repository, backend))
+    if head_sha is None:
+        print(f"The feature cache has no history of {repository} with the {backend} backend, run osdp.py first")
+        return None
+    if head_sha != git("rev-parse", "HEAD").strip():
+        print(f"The cached history ends at {head_sha[:7]}, run osdp.py to include the newer commits")
+    return history
+
+
+def load_forest(model_dir, repository):
+    forest_path = get_forest_path(get_model_path(model_dir, repository)) if model_dir else None
+    if forest_path is None or not os.path.isfile(forest_path):
+        print(f"There is no stored model of {repository}, run osdp.py with a MODEL_DIR first")
+        return None
+    forest = CompiledForest(forest_path)
+    if forest.repository != repository or forest.feature_labels != FEATURE_LABELS or forest.version != MODEL_VERSION:
+        print("The stored model does not match the repository or the features, run osdp.py again")
+        return None
+    return forest
+
+
+def get_author():
+    """ Returns the GitHub login of the author, which keys the experience in the history of every backend """
+    return git_config("github.user")
+
+
+def get_remote_repository():
+    match = GITHUB_REMOTE.search(git_config("remote.origin.url") or "")
+    return match.group("repository") if match else None
+
+
+def is_fix(message):
+    if not message:
+        return False
+    # the detector imports PyGithub, which is only worth loading for a message to check
+    from detector import is_message_fix
+
+    return is_message_fix(message)
+
+
+def git_config(name):
+    result = subprocess.run(["git", "config", name], capture_output=True, encoding="utf-8")
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def git(*args):
+    result = subprocess.run(["git", *args], check=True, capture_output=True, encoding="utf-8", errors="replace")
+    return result.stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scores the uncommitted changes of the current git repository with "
+                                                 "the history and model cached by osdp.py, without any request")
+    parser.add_argument("--staged", action="store_true", help="score the staged changes instead of the working tree")
+    parser.add_argument("--base", default="HEAD", help="the revision to diff against, like @{upstream} in a "
+                                                       "pre-push hook")
+    parser.add_argument("--message", default="", help="the commit message, to check whether the changes are a fix")
+    parser.add_argument("--max-probability", type=float, help="exit with an error above this defect probability, "
+                                                              "which stops the push")
+    arguments = parser.parse_args()
+    settings = read_settings(HOOK_SETTINGS, optional=OPTIONAL_SETTINGS)
+    probability = score_diff(settings, arguments.staged, arguments.base, arguments.message)
+    if probability is not None and arguments.max_probability is not None \
+            and probability > arguments.max_probability:
+        print(f"The defect probability is above {arguments.max_probability:.2%}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+import os
+import re
+import sys
+import json
+import time
+import cProfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+ENDPOINT_PATTERNS = [
+    (re.compile(r"^https?://[^/]+"), ""),
+    (re.compile(r"\?.*$"), ""),
+    (re.compile(r"^/repos/[^/]+/[^/]+"), "/repos/{owner}/{repo}"),
+    (re.compile(r"/[0-9a-f]{40}(?=/|$)"), "/{sha}"),
+    (re.compile(r"/\d+(?=/|$)"), "/{number}"),
+]
+
+
+class Profiler:
+
+    def __init__(self, profile_path=None):
+        """ Records the wall time, requests, GraphQL cost, retries, cache use and memory of each stage and commit """
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.start = time.time()
+        self.stages = []
+        self.stage_name = None
+        self.commits = {}
+        self.caches = {}
+        self.profile_path = profile_path
+        self.profile = cProfile.Profile() if profile_path else None
+
+    @contextmanager
+    def stage(self, name):
+        """ Attributes everything recorded until the block ends to the stage, including worker threads """
+        stage = {"name": name, "wall_time": 0, "requests": {}, "graphql_cost": 0, "retries": 0}
+        with self.lock:
+            self.stages.append(stage)
+            self.stage_name = name
+        if self.profile is not None:
+            self.profile.enable()
+        start = time.time()
+        try:
+            yield stage
+        finally:
+            if self.profile is not None:
+                self.profile.disable()
+            stage["wall_time"] = time.time() - start
+            stage["peak_memory"] = get_peak_memory()
+            with self.lock:
+                self.stage_name = None
+
+    @contextmanager
+    def commit(self, sha, step):
+        """ Attributes the requests, GraphQL cost and cache use of the current thread to the commit """
+        with self.batch([sha], step):
+            yield
+
+    @contextmanager
+    def batch(self, shas, step):
+        """ Attributes everything the current thread records to each commit of a batch, like fixes blamed at once """
+        previous_shas = getattr(self.local, "shas", ())
+        self.local.shas = tuple(shas)
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.local.shas = previous_shas
+            self.record_time(shas, step, time.time() - start)
+
+    def record_time(self, shas, step, step_time):
+        """ Adds the time of a step to the commits, also for steps timed in another process """
+        peak_memory = get_peak_memory()
+        with self.lock:
+            for sha in shas:
+                commit = self.get_commit(sha)
+                commit[f"{step}_time"] = commit.get(f"{step}_time", 0) + step_time
+                commit["peak_memory"] = peak_memory
+
+    def get_commit(self, sha):
+        if sha not in self.commits:
+            self.commits[sha] = {"requests": {}, "retries": 0, "graphql_cost": 0, "caches": {}}
+        return self.commits[sha]
+
+    def get_commits(self):
+        # the commits of the current thread, the caller holds the lock
+        return [self.get_commit(sha) for sha in getattr(self.local, "shas", ())]
+
+    def record_request(self, method, url, is_retried):
+        endpoint = f"{method.upper()} {get_endpoint(url)}"
+        with self.lock:
+            for record in [self.get_stage(), *self.get_commits()]:
+                if record is not None:
+                    record["requests"][endpoint] = record["requests"].get(endpoint, 0) + 1
+                    record["retries"] += int(is_retried)
+
+    def record_cost(self, cost):
+        with self.lock:
+            for record in [self.get_stage(), *self.get_commits()]:
+                if record is not None:
+                    record["graphql_cost"] += cost
+
+    def record_cache(self, kind, hits, misses):
+        with self.lock:
+            for caches in [self.caches, *[commit["caches"] for commit in self.get_commits()]]:
+                cache = caches.setdefault(kind, {"hits": 0, "misses": 0})
+                cache["hits"] += hits
+                cache["misses"] += misses
+
+    def get_stage(self):
+        if self.stage_name is None or len(self.stages) == 0:
+            return None
+        return self.stages[-1]
+
+    def mark_cached(self, sha):
+        with self.lock:
+            self.get_commit(sha)["cached"] = True
+
+    def get_report(self, **details):
+        with self.lock:
+            requests = {}
+            for stage in self.stages:
+                for endpoint, count in stage["requests"].items():
+                    requests[endpoint] = requests.get(endpoint, 0) + count
+            return {
+                **details,
+                "wall_time": time.time() - self.start,
+                "peak_memory": get_peak_memory(),
+                "requests": requests,
+                "graphql_cost": sum(stage["graphql_cost"] for stage in self.stages),
+                "retries": sum(stage["retries"] for stage in self.stages),
+                "caches": self.caches,
+                "stages": self.stages,
+                "commits": self.commits,
+            }
+
+    def write_report(self, path, **details):
+        """ Writes the JSON report, and the cProfile statistics of the stages if a profile path was given """
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as report_file:
+                json.dump(self.get_report(**details), report_file, indent=2)
+            print(f"Wrote the run report to {path}")
+        if self.profile is not None:
+            self.profile.dump_stats(self.profile_path)
+            print(f"Wrote the profile to {self.profile_path}")
+
+
+def get_endpoint(url):
+    """ Returns the path of a request with its shas, numbers and repository replaced by placeholders """
+    for pattern, replacement in ENDPOINT_PATTERNS:
+        url = pattern.sub(replacement, url)
+    return url
+
+
+def get_peak_memory():
+    """ Returns the peak resident memory of the process in bytes, None where it is not available """
+    if resource is None:
+        return None
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak_memory if sys.platform == "darwin" else peak_memory * 1024
@@ -0,0 +1,198 @@
+import re
+import time
+import random
+import threading
+import requests
+from github.Requester import Requester, HTTPRequestsConnectionClass, HTTPSRequestsConnectionClass
+
+from profiling import Profiler
+
+PACE_FRACTION = 0.2
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 2
+BACKOFF_LIMIT = 120
+POOL_SIZE = 16
+IMMUTABLE_URL = re.compile(r"/repos/[^/]+/[^/]+/commits/[0-9a-f]{40}$")
+
+
+class RateLimitScheduler:
+
+    def __init__(self, profiler=None, budget=None, response_cache=None):
+        """ Paces every GitHub request by the REST and GraphQL budgets reported in the response headers """
+        self.profiler = profiler if profiler is not None else Profiler()
+        self.budget = budget if budget is not None else RateLimitBudget()
+        self.response_cache = response_cache
+        self.lock = threading.Lock()
+        self.request_counts = {}
+        self.retry_count = 0
+        self.wait_time = 0
+        self.graphql_cost = 0
+        self.session = ScheduledSession(self)
+
+    def install(self):
+        """ Routes the requests of PyGithub through the scheduler """
+        scheduler = self
+
+        class ScheduledHTTPSConnection(HTTPSRequestsConnectionClass):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.session = scheduler.session
+
+        class ScheduledHTTPConnection(HTTPRequestsConnectionClass):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.session = scheduler.session
+
+        Requester.injectConnectionClasses(ScheduledHTTPConnection, ScheduledHTTPSConnection)
+
+    def send(self, send_request, method, url, *args, **kwargs):
+        resource = "graphql" if url.rstrip("/").endswith("/graphql") else "core"
+        for attempt in range(MAX_ATTEMPTS):
+            self.wait(resource)
+            response = send_request(method, url, *args, **kwargs)
+            with self.lock:
+                self.request_counts[resource] = self.request_counts.get(resource, 0) + 1
+            self.profiler.record_request(method, url, attempt > 0)
+            self.update(resource, response)
+            delay = self.get_retry_delay(resource, response, attempt)
+            if delay is None:
+                return response
+            print(f"Retrying a {resource} request in {delay:.0f}s (status {response.status_code}, "
+                  f"attempt {attempt + 1})")
+            with self.lock:
+                self.retry_count += 1
+            self.sleep(delay)
+        return response
+
+    def wait(self, resource):
+        """ Waits for the next request slot, spreading the remaining budget until its reset when it runs low """
+        budgets = self.budget.budgets
+        next_request = self.budget.next_request
+        with self.budget.lock:
+            now = time.time()
+            budget = budgets.get(resource)
+            start = now
+            if budget is not None and budget["reset"] > now:
+                if budget["remaining"] <= 0:
+                    start = max(now, next_request.get(resource, now), budget["reset"] + 1)
+                    print(f"The {resource} rate limit is used up, pausing until {time.ctime(budget['reset'])}")
+                elif budget["remaining"] < budget["limit"] * PACE_FRACTION:
+                    interval = (budget["reset"] - now) / budget["remaining"]
+                    start = max(now, next_request.get(resource, now) + interval)
+                # the budgets can be proxies of another process, which only see assigned values
+                budgets[resource] = {**budget, "remaining": budget["remaining"] - 1}
+            next_request[resource] = start
+        self.sleep(start - time.time())
+
+    def update(self, resource, response):
+        headers = response.headers
+        if "X-RateLimit-Remaining" not in headers:
+            return
+        with self.budget.lock:
+            self.budget.budgets[headers.get("X-RateLimit-Resource", resource)] = {
+                "limit": int(headers["X-RateLimit-Limit"]),
+                "remaining": int(headers["X-RateLimit-Remaining"]),
+                "reset": int(headers["X-RateLimit-Reset"]),
+            }
+
+    def get_retry_delay(self, resource, response, attempt):
+        """ Returns the delay before retrying the response, None if it should not be retried """
+        if attempt == MAX_ATTEMPTS - 1:
+            return None
+        if response.status_code in [403, 429]:
+            if "Retry-After" in response.headers:
+                return int(response.headers["Retry-After"])
+            if response.headers.get("X-RateLimit-Remaining") == "0":
+                return max(int(response.headers["X-RateLimit-Reset"]) - time.time(), 0) + 1
+            if "secondary rate limit" in response.text.lower():
+                return get_backoff(attempt)
+            return None
+        if response.status_code >= 500:
+            return get_backoff(attempt)
+        if resource == "graphql" and b'"RATE_LIMITED"' in response.content:
+            budget = self.budget.budgets.get(resource)
+            return max(budget["reset"] - time.time(), 0) + 1 if budget is not None else get_backoff(attempt)
+        return None
+
+    def add_cost(self, result):
+        """ Counts the points a GraphQL query cost, as reported by its rateLimit field """
+        if result.get("rateLimit") is None:
+            return
+        with self.lock:
+            self.graphql_cost += result["rateLimit"]["cost"]
+        self.profiler.record_cost(result["rateLimit"]["cost"])
+
+    def sleep(self, delay):
+        if delay <= 0:
+            return
+        with self.lock:
+            self.wait_time += delay
+        time.sleep(delay)
+
+    def describe(self):
+        with self.budget.lock:
+            budgets = ", ".join(f"{resource}: {budget['remaining']}/{budget['limit']} until "
+                                f"{time.ctime(budget['reset'])}" for resource, budget in self.budget.budgets.items())
+        with self.lock:
+            return f"Rate limits: {budgets or 'unknown'}, requests: {self.request_counts}, " \
+                   f"GraphQL cost: {self.graphql_cost}, retries: {self.retry_count}, waited {self.wait_time:.0f}s"
+
+
+class RateLimitBudget:
+
+    def __init__(self, lock=None, budgets=None, next_request=None):
+        """ The remaining budgets of a token and the next request slots, shared by all schedulers using the token """
+        self.lock = lock if lock is not None else threading.Lock()
+        self.budgets = budgets if budgets is not None else {}
+        self.next_request = next_request if next_request is not None else {}
+
+
+def create_shared_budget(manager):
+    """ Returns a budget which the schedulers of several processes share through a multiprocessing manager """
+    return RateLimitBudget(manager.Lock(), manager.dict(), manager.dict())
+
+
+class ScheduledSession(requests.Session):
+
+    def __init__(self, scheduler):
+        """ A pooled session sending every request through the scheduler """
+        super().__init__()
+        self.scheduler = scheduler
+        self.mount("https://", requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE))
+        self.mount("http://", requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE))
+
+    def request(self, method, url, *args, **kwargs):
+        response_cache = self.scheduler.response_cache
+        if response_cache is None or method.upper() != "GET":
+            return self.scheduler.send(super().request, method, url, *args, **kwargs)
+        headers = dict(kwargs.pop("headers", None) or {})
+        key = get_cache_key(url, headers)
+        cached = response_cache.load(key)
+        if cached is not None and is_immutable(url):
+            self.scheduler.profiler.record_cache("responses", 1, 0)
+            return cached
+        if cached is not None and "ETag" in cached.headers:
+            # conditional requests answered with 304 do not count against the rate limit
+            headers["If-None-Match"] = cached.headers["ETag"]
+        response = self.scheduler.send(super().request, method, url, *args, headers=headers, **kwargs)
+        if response.status_code == 304 and cached is not None:
+            self.scheduler.profiler.record_cache("responses", 1, 0)
+            return cached
+        self.scheduler.profiler.record_cache("responses", 0, 1)
+        if response.status_code == 200:
+            response_cache.save(key, response)
+        return response
+
+
+def get_cache_key(url, headers):
+    return f"{url} {headers.get('Accept', '')}"
+
+
+def is_immutable(url):
+    """ Returns whether the response can not change, like the details of a commit requested by its sha """
+    return IMMUTABLE_URL.search(url.split("?", 1)[0]) is not None
+
+
+def get_backoff(attempt):
+    # jitter keeps concurrent workers from retrying at the same moment
+    return min(BACKOFF_BASE ** (attempt + 1), BACKOFF_LIMIT) * random.uniform(0.5, 1.5)
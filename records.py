@@ -0,0 +1,101 @@
+import sys
+
+
+class StatsRecord:
+
+    def __init__(self, additions, deletions):
+        """ Line statistics of a commit, shaped like github.CommitStats """
+        self.additions = additions
+        self.deletions = deletions
+        self.total = additions + deletions
+
+
+class FileRecord:
+    __slots__ = ["filename", "additions", "deletions", "changes", "previous_filename"]
+
+    def __init__(self, filename, additions, deletions, previous_filename=None):
+        """ A changed file of a commit without its patch, shaped like github.File """
+        # paths repeat across many commits, interning keeps a single copy of each
+        self.filename = sys.intern(filename)
+        self.additions = additions
+        self.deletions = deletions
+        self.changes = additions + deletions
+        self.previous_filename = sys.intern(previous_filename) if previous_filename else None
+
+
+def get_file_records(files):
+    """ Returns compact records of PyGithub files, which keep their patch and raw API payload alive """
+    return [file if isinstance(file, FileRecord) else
+            FileRecord(file.filename, file.additions, file.deletions, file.previous_filename) for file in files]
+
+
+class GitCommitRecord:
+
+    def __init__(self, message):
+        """ The git data of a commit, shaped like github.GitCommit """
+        self.message = message
+
+
+class CommitRecord:
+
+    def __init__(self, sha, author, message, files, ci_source=None, stats=None):
+        """ A commit read from a source other than the REST API, shaped like github.Commit """
+        self.sha = sha
+        self.author = author
+        self.commit = GitCommitRecord(message)
+        self.files = files
+        if stats is None:
+            stats = StatsRecord(sum(file.additions for file in files), sum(file.deletions for file in files))
+        self.stats = stats
+        self.ci_source = ci_source
+
+    def get_combined_status(self):
+        return self.ci_source.get_combined_status()
+
+    def get_check_runs(self):
+        return self.ci_source.get_check_runs()
+
+
+class StatusRecord:
+
+    def __init__(self, state):
+        """ A commit status, shaped like github.CommitStatus """
+        self.state = state
+
+
+class CombinedStatusRecord:
+
+    def __init__(self, states, total_count=None):
+        """ The latest status of each context, shaped like github.CommitCombinedStatus """
+        self.statuses = [StatusRecord(state) for state in states]
+        self.total_count = len(self.statuses) if total_count is None else total_count
+
+
+class CheckRunRecord:
+
+    def __init__(self, status, conclusion):
+        """ A check run, shaped like github.CheckRun """
+        self.status = status
+        self.conclusion = conclusion
+
+
+class CheckRunsRecord(list):
+
+    def __init__(self, check_runs, total_count):
+        """ The check runs of a commit, shaped like a PaginatedList of github.CheckRun """
+        super().__init__(check_runs)
+        self.totalCount = total_count
+
+
+class CiRecord:
+
+    def __init__(self, combined_status, check_runs):
+        """ Prefetched CI results that stand in for the status endpoints of a commit """
+        self.combined_status = combined_status
+        self.check_runs = check_runs
+
+    def get_combined_status(self):
+        return self.combined_status
+
+    def get_check_runs(self):
+        return self.check_runs
@@ -0,0 +1,349 @@
+import os
+import re
+import gzip
+import json
+import time
+import random
+import hashlib
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+from graphql_adapter import CHECK_RUN_LIMIT
+from rate_limit import RateLimitScheduler
+
+RATE_LIMIT = 1000000
+DEFAULT_PAGE_SIZE = 30
+AUTHOR_COUNT = 25
+FIX_RATE = 0.2
+CI_FAILURE_RATE = 0.1
+# the share of fixes referencing a bug issue, and of the other commits referencing an issue which is no bug
+BUG_REFERENCE_RATE = 0.7
+OTHER_REFERENCE_RATE = 0.1
+START_TIME = datetime(2020, 1, 1, tzinfo=timezone.utc)
+RECORDED_HEADERS = ["Content-Type", "Link", "X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset",
+                    "X-RateLimit-Resource"]
+ISSUES_AFTER = re.compile(r'after: (null|"\d+")')
+ISSUES_SINCE = re.compile(r'since: "([^"]+)"')
+BLAME_QUERY = re.compile(r'(\w+): object\(expression: "(\w+)"\)\s*\{\s*\.\.\. on Commit \{\s*'
+                         r'blame\(path: ("(?:[^"\\]|\\.)*")')
+
+
+class ReplayServer:
+
+    def __init__(self, source):
+        """ A local stand-in for the GitHub REST and GraphQL APIs, answering from a synthetic or recorded source """
+        self.source = source
+        self.request_count = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), ReplayHandler)
+        self.server.daemon_threads = True
+        self.server.replay = self
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.graphql_url = f"{self.url}/graphql"
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def respond(self, method, path, body):
+        self.request_count += 1
+        status, headers, payload = self.source.respond(method, path, body, self.url)
+        headers = {"Content-Type": "application/json; charset=utf-8", **get_rate_limit_headers(path), **headers}
+        return status, headers, payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.reply(b"")
+
+    def do_POST(self):
+        self.reply(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+
+    def reply(self, body):
+        status, headers, payload = self.server.replay.respond(self.command, self.path, body)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class SyntheticRepository:
+
+    def __init__(self, commit_count, seed=0, repository="synthetic/repository"):
+        """ A deterministic repository with a realistic mix of authors, files, renames, fixes and CI results """
+        self.repository = repository
+        self.owner, self.name = repository.split("/")
+        rng = random.Random(seed)
+        # the issues use a generator of their own, so the commits stay the same as without them
+        issue_rng = random.Random(f"{seed}:issues")
+        self.commits = []
+        self.issues = []
+        self.index = {}
+        self.file_touches = {}
+        paths = [f"src/module{i}.py" for i in range(20)]
+        for i in range(commit_count):
+            sha = hashlib.sha1(f"{seed}:{i}".encode()).hexdigest()
+            author = f"developer{min(int(rng.paretovariate(1.2)), AUTHOR_COUNT) - 1}"
+            files = []
+            for _ in range(min(int(rng.expovariate(0.6)) + 1, 30)):
+                previous_path = None
+                if rng.random() < 0.1:
+                    path = f"src/package{rng.randrange(50)}/module{len(paths)}.py"
+                    paths.append(path)
+                else:
+                    # recently changed files are changed again more often
+                    path = paths[max(len(paths) - 1 - int(rng.expovariate(0.05)), 0)]
+                    if any(file["filename"] == path for file in files):
+                        continue
+                    if rng.random() < 0.01:
+                        previous_path, path = path, path.replace(".py", f"_{i}.py")
+                        paths[paths.index(previous_path)] = path
+                files.append({"filename": path, "previous_filename": previous_path,
+                              "additions": int(rng.expovariate(0.05)), "deletions": int(rng.expovariate(0.1))})
+                self.file_touches.setdefault(path, []).append(i)
+                if previous_path:
+                    self.file_touches[path] = self.file_touches.get(previous_path, []) + self.file_touches[path]
+            is_fix = rng.random() < FIX_RATE
+            message = f"{'Fix' if is_fix else rng.choice(['Add', 'Update', 'Refactor'])} " \
+                      f"{files[0]['filename']} for change {i}"
+            committed_time = START_TIME + timedelta(hours=i)
+            if issue_rng.random() < (BUG_REFERENCE_RATE if is_fix else OTHER_REFERENCE_RATE):
+                # bugs were reported before their fix, the issue is closed by it
+                label = "bug" if is_fix else issue_rng.choice(["documentation", "enhancement"])
+                created_time = committed_time - timedelta(hours=issue_rng.randint(1, 200))
+                self.issues.append({"number": len(self.issues) + 1, "state": "CLOSED",
+                                    "createdAt": get_date(created_time),
+                                    "updatedAt": get_date(committed_time + timedelta(minutes=1)),
+                                    "labels": {"nodes": [{"name": label}]}})
+                message += f" (#{len(self.issues)})"
+            states = [("failure" if rng.random() < CI_FAILURE_RATE else "success") for _ in range(rng.randint(0, 2))]
+            conclusions = [("failure" if rng.random() < CI_FAILURE_RATE else "success")
+                           for _ in range(rng.randint(0, 3))]
+            self.index[sha] = i
+            self.commits.append({"sha": sha, "author": author, "message": message, "files": files,
+                                 "states": states, "conclusions": conclusions,
+                                 "committedDate": get_date(committed_time)})
+
+    def respond(self, method, path, body, base_url):
+        url = urlsplit(path)
+        parameters = dict(parse_qsl(url.query))
+        parts = url.path.strip("/").split("/")
+        if method == "POST" and parts == ["graphql"]:
+            return 200, {}, {"data": self.graphql(json.loads(body))}
+        if parts[:3] != ["repos", self.owner, self.name]:
+            return 404, {}, {"message": "Not Found"}
+        parts = parts[3:]
+        repo_url = f"{base_url}/repos/{self.repository}"
+        if len(parts) == 0:
+            return 200, {}, {"id": 1, "name": self.name, "full_name": self.repository, "url": repo_url,
+                             "owner": {"login": self.owner}}
+        if parts == ["commits"]:
+            return self.list_commits(parameters, repo_url)
+        if len(parts) >= 2 and parts[0] == "commits" and parts[1] in self.index:
+            commit = self.commits[self.index[parts[1]]]
+            if len(parts) == 2:
+                return 200, {}, self.get_commit(commit, repo_url)
+            if parts[2:] == ["status"]:
+                statuses = [{"id": i, "state": state, "context": f"ci/{i}"} for i, state in enumerate(commit["states"])]
+                state = "failure" if "failure" in commit["states"] else "success"
+                return 200, {}, {"sha": commit["sha"], "state": state, "statuses": statuses,
+                                 "total_count": len(statuses)}
+            if parts[2:] == ["check-runs"]:
+                check_runs = [{"id": i, "name": f"check{i}", "status": "completed", "conclusion": conclusion}
+                              for i, conclusion in enumerate(commit["conclusions"])]
+                return 200, {}, {"total_count": len(check_runs), "check_runs": check_runs}
+        if len(parts) == 2 and parts[0] == "compare":
+            return self.compare(*parts[1].split("...", 1))
+        return 404, {}, {"message": "Not Found"}
+
+    def list_commits(self, parameters, repo_url):
+        head = self.index.get(parameters.get("sha"), len(self.commits) - 1)
+        page = int(parameters.get("page", 1))
+        page_size = int(parameters.get("per_page", DEFAULT_PAGE_SIZE))
+        last_page = max((head + page_size) // page_size, 1)
+        newest = head - (page - 1) * page_size
+        commits = [self.get_commit_summary(self.commits[i], repo_url)
+                   for i in range(newest, max(newest - page_size, -1), -1)]
+        links = []
+        link_parameters = {key: value for key, value in parameters.items() if key != "page"}
+        if page < last_page:
+            links.append(f'<{repo_url}/commits?{urlencode({**link_parameters, "page": page + 1})}>; rel="next"')
+            links.append(f'<{repo_url}/commits?{urlencode({**link_parameters, "page": last_page})}>; rel="last"')
+        return 200, {"Link": ", ".join(links)} if links else {}, commits
+
+    def compare(self, base, head):
+        if base not in self.index or head not in self.index:
+            return 404, {}, {"message": "Not Found"}
+        # the history is linear, the newer commit is ahead of the older one
+        distance = self.index[head] - self.index[base]
+        status = "ahead" if distance > 0 else "behind" if distance < 0 else "identical"
+        return 200, {}, {"status": status, "ahead_by": max(distance, 0), "behind_by": max(-distance, 0),
+                         "total_commits": max(distance, 0)}
+
+    def get_commit_summary(self, commit, repo_url):
+        return {"sha": commit["sha"], "url": f"{repo_url}/commits/{commit['sha']}",
+                "commit": {"message": commit["message"], "author": {"name": commit["author"]}},
+                "author": {"login": commit["author"], "id": int(commit["author"][len("developer"):])}}
+
+    def get_commit(self, commit, repo_url):
+        files = []
+        for file in commit["files"]:
+            # a patch of the size of the change, the adapter has to drop it
+            patch = "@@ -1 +1 @@\n" + "+added line\n" * min(file["additions"], 200)
+            files.append({"filename": file["filename"], "previous_filename": file["previous_filename"],
+                          "additions": file["additions"], "deletions": file["deletions"],
+                          "changes": file["additions"] + file["deletions"],
+                          "status": "renamed" if file["previous_filename"] else "modified", "patch": patch})
+        additions = sum(file["additions"] for file in commit["files"])
+        deletions = sum(file["deletions"] for file in commit["files"])
+        return {**self.get_commit_summary(commit, repo_url), "files": files,
+                "stats": {"additions": additions, "deletions": deletions, "total": additions + deletions}}
+
+    def graphql(self, request):
+        query = request["query"]
+        if "history(" in query:
+            return {"rateLimit": {"cost": 1}, "repository": {"object": {"history": self.history(request["variables"])}}}
+        if "issues(" in query:
+            return {"rateLimit": {"cost": 1}, "repository": {"issues": self.list_issues(query)}}
+        repository = {}
+        for alias, sha, path in BLAME_QUERY.findall(query):
+            repository[alias] = {"blame": {"ranges": self.blame(sha, json.loads(path))}}
+        return {"rateLimit": {"cost": 1}, "repository": repository}
+
+    def history(self, variables):
+        head = self.index[variables["expression"]] if variables["expression"] in self.index else len(self.commits) - 1
+        start = int(variables["cursor"]) if variables.get("cursor") else 0
+        indexes = list(range(head - start, max(head - start - variables["pageSize"], -1), -1))
+        nodes = []
+        for i in indexes:
+            commit = self.commits[i]
+            check_runs = [{"status": "COMPLETED", "conclusion": conclusion.upper()}
+                          for conclusion in commit["conclusions"]]
+            nodes.append({
+                "oid": commit["sha"], "message": commit["message"],
+                "additions": sum(file["additions"] for file in commit["files"]),
+                "deletions": sum(file["deletions"] for file in commit["files"]),
+                "author": {"user": {"login": commit["author"]}},
+                "status": {"contexts": [{"state": state.upper()} for state in commit["states"]]}
+                if commit["states"] else None,
+                "checkSuites": {"totalCount": 1, "nodes": [
+                    {"checkRuns": {"totalCount": len(check_runs), "nodes": check_runs[:CHECK_RUN_LIMIT]}}]},
+            })
+        end = start + len(nodes)
+        return {"totalCount": head + 1, "pageInfo": {"hasNextPage": end < head + 1, "endCursor": str(end)},
+                "nodes": nodes}
+
+    def list_issues(self, query):
+        """ Returns a page of the issues updated since the filtered time, oldest update first """
+        since = ISSUES_SINCE.search(query)
+        issues = sorted((issue for issue in self.issues if since is None or issue["updatedAt"] >= since.group(1)),
+                        key=lambda issue: issue["updatedAt"])
+        after = ISSUES_AFTER.search(query).group(1)
+        start = 0 if after == "null" else int(json.loads(after))
+        nodes = issues[start:start + 100]
+        end = start + len(nodes)
+        return {"pageInfo": {"hasNextPage": end < len(issues), "endCursor": str(end)}, "nodes": nodes}
+
+    def blame(self, sha, path):
+        """ Returns blame ranges over the commits which changed the file, ending with the given commit """
+        i = self.index[sha]
+        touches = [touch for touch in self.file_touches.get(path, []) if touch <= i][-5:]
+        rng = random.Random(f"{sha}:{path}")
+        ranges = []
+        line = 1
+        for touch in touches:
+            line_count = rng.randint(1, 20)
+            ranges.append({"startingLine": line, "endingLine": line + line_count - 1,
+                           "commit": {"oid": self.commits[touch]["sha"],
+                                      "committedDate": self.commits[touch]["committedDate"]}})
+            line += line_count
+        return ranges
+
+
+class RecordedResponses:
+
+    def __init__(self, path):
+        """ Responses recorded from GitHub, replayed by method, path and request body """
+        with gzip.open(path, "rt", encoding="utf-8") as fixture_file:
+            fixture = json.load(fixture_file)
+        self.repository = fixture["repository"]
+        self.commit_sha = fixture["commit_sha"]
+        self.commit_limit = fixture["commit_limit"]
+        self.backends = fixture["backends"]
+        self.origins = [fixture["api_url"], fixture["graphql_url"].rsplit("/graphql", 1)[0]]
+        self.responses = fixture["responses"]
+
+    def respond(self, method, path, body, base_url):
+        response = self.responses.get(get_request_key(method, path, body))
+        if response is None:
+            return 404, {}, {"message": f"No recorded response for {method} {path}"}
+        headers = {name: value for name, value in response["headers"].items() if not name.startswith("X-RateLimit")}
+        payload = response["body"]
+        for origin in self.origins:
+            payload = payload.replace(origin, base_url)
+            if "Link" in headers:
+                headers["Link"] = headers["Link"].replace(origin, base_url)
+        return response["status"], headers, payload.encode()
+
+
+class RecordingScheduler(RateLimitScheduler):
+
+    def __init__(self, profiler=None):
+        """ Schedules requests like the rate limit scheduler and records every final response """
+        super().__init__(profiler)
+        self.responses = {}
+
+    def send(self, send_request, method, url, *args, **kwargs):
+        response = super().send(send_request, method, url, *args, **kwargs)
+        body = kwargs.get("data") or (json.dumps(kwargs["json"]) if kwargs.get("json") is not None else b"")
+        key = get_request_key(method, url, body)
+        with self.lock:
+            self.responses[key] = {"status": response.status_code, "body": response.text,
+                                   "headers": {name: response.headers[name] for name in RECORDED_HEADERS
+                                               if name in response.headers}}
+        return response
+
+    def save(self, path, repository, commit_sha, commit_limit, backends, api_url, graphql_url):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(path, "wt", encoding="utf-8") as fixture_file:
+            json.dump({"repository": repository, "commit_sha": commit_sha, "commit_limit": commit_limit,
+                       "backends": backends, "api_url": api_url, "graphql_url": graphql_url,
+                       "responses": self.responses}, fixture_file)
+
+
+def get_request_key(method, url, body):
+    """ Identifies a request by its method, its path with sorted parameters and the query of a GraphQL body """
+    url = urlsplit(url)
+    key = f"{method.upper()} {url.path}"
+    if url.query:
+        key += "?" + urlencode(sorted(parse_qsl(url.query)))
+    if body:
+        body = body.encode() if isinstance(body, str) else body
+        request = json.loads(body)
+        key += " " + hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+    return key
+
+
+def get_rate_limit_headers(path):
+    resource = "graphql" if urlsplit(path).path.rstrip("/").endswith("/graphql") else "core"
+    return {"X-RateLimit-Limit": str(RATE_LIMIT), "X-RateLimit-Remaining": str(RATE_LIMIT),
+            "X-RateLimit-Reset": str(int(time.time()) + 3600), "X-RateLimit-Resource": resource}
+
+
+def get_date(time):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -0,0 +1,46 @@
+import os
+import json
+import sqlite3
+import threading
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+SKIPPED_HEADERS = ["content-encoding", "content-length", "transfer-encoding", "connection"]
+
+
+class ResponseCache:
+
+    def __init__(self, path):
+        """ An on-disk store of GET responses, shared by the threads and processes of all runs using it """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        # the prefetching threads share the connection, the lock keeps them from using it at the same time
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS responses "
+                                    "(key TEXT PRIMARY KEY, url TEXT, headers TEXT, body BLOB)")
+
+    def load(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT url, headers, body FROM responses WHERE key = ?",
+                                          (key,)).fetchone()
+        if row is None:
+            return None
+        response = requests.Response()
+        response.status_code = 200
+        response.url = row[0]
+        response.headers = CaseInsensitiveDict(json.loads(row[1]))
+        response.encoding = "utf-8"
+        response._content = row[2]
+        return response
+
+    def save(self, key, response):
+        # rate limit headers of a stored response would be stale when it is reused
+        headers = {name: value for name, value in response.headers.items()
+                   if name.lower() not in SKIPPED_HEADERS and not name.lower().startswith("x-ratelimit")}
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                                    (key, response.url, json.dumps(headers), response.content))
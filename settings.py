@@ -0,0 +1,26 @@
+import os
+
+DOTENV_PATH = ".env"
+
+
+def read_settings(defaults, overrides=None, optional=()):
+    """
+    Returns the settings from the overrides, the environment, the .env file and the defaults, in this order.
+
+    An empty value disables an optional setting, like a path of a cache, other empty values fall back to the next
+    source.
+    """
+    dotenv = {}
+    if os.path.isfile(DOTENV_PATH):
+        with open(DOTENV_PATH) as fp:
+            for line in fp.readlines():
+                line = line.strip().split("=", 1)
+                if len(line) == 2:
+                    dotenv[line[0]] = line[1]
+    sources = [overrides if overrides is not None else {}, os.environ, dotenv]
+    settings = {}
+    for setting, default in defaults.items():
+        values = [source[setting] for source in sources
+                  if setting in source and (source[setting] != "" or setting in optional)]
+        settings[setting] = values[0] if values else default
+    return settings
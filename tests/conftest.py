@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from replay_server import ReplayServer, SyntheticRepository  # noqa: E402
+
+
+@pytest.fixture
+def synthetic_repository():
+    return SyntheticRepository(200, seed=1)
+
+
+@pytest.fixture
+def replay_server(synthetic_repository):
+    server = ReplayServer(synthetic_repository).start()
+    yield server
+    server.stop()
@@ -0,0 +1,60 @@
+from commit import Commit
+from detector import Detector, BLAME_BATCH_SIZE
+from github_adapter import GithubAdapter
+from replay_server import ReplayServer, SyntheticRepository
+
+
+class ForbiddenIssuesRepository(SyntheticRepository):
+
+    def respond(self, method, path, body, base_url):
+        """ Answers the issue queries with an error, like for a token without access to the issues """
+        if method == "POST" and b"issues(" in body:
+            return 200, {}, {"data": None, "errors": [{"type": "FORBIDDEN",
+                                                        "message": "Resource not accessible by integration"}]}
+        return super().respond(method, path, body, base_url)
+
+
+def create_detector(server, repository):
+    return Detector("token", repository.repository, None, server.graphql_url, fix_confirmation="keywords")
+
+
+def get_single_blames(detector, blame_targets):
+    """ Blames every fix in a query of its own, like before the blames were batched """
+    return {target: detector.git_blame_batch([target])[0] for target in blame_targets}
+
+
+def test_batched_blames_match_single_blames(replay_server, synthetic_repository):
+    detector = create_detector(replay_server, synthetic_repository)
+    blame_targets = [(commit["sha"], commit["files"][0]["filename"]) for commit in synthetic_repository.commits
+                     if len(commit["files"]) == 1]
+    assert len(blame_targets) > 2 * BLAME_BATCH_SIZE
+
+    assert detector.git_blames(blame_targets) == get_single_blames(detector, blame_targets)
+
+
+def test_streamed_blames_match_single_blames(replay_server, synthetic_repository):
+    adapter = GithubAdapter("token", synthetic_repository.repository, None, api_url=replay_server.url)
+    detector = create_detector(replay_server, synthetic_repository)
+    commits = []
+    for commit in adapter.iter_features():
+        detector.observe(commit)
+        commits.append(commit)
+    blame_targets = [(commit.get("sha"), commit.get("files")[0].filename) for commit in commits
+                     if commit.get("file_count") == 1 and detector.is_confirmed_fix(commit)]
+    assert len(detector.blame_futures) > 0
+
+    assert detector.git_blames(blame_targets) == get_single_blames(detector, blame_targets)
+
+
+def test_failed_issue_download_falls_back_to_keywords():
+    repository = ForbiddenIssuesRepository(50)
+    server = ReplayServer(repository).start()
+    try:
+        detector = Detector("token", repository.repository, None, server.graphql_url)
+        commit = Commit()
+        commit.add("message", "Fix the crash on startup (#3)")
+
+        assert detector.is_confirmed_fix(commit)
+        assert detector.issue_index is None
+    finally:
+        server.stop()
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from estimator import CompiledForest, DEFAULT_PARAMS, WARM_START_TREES, save_forest
+from feature_store import FEATURE_LABELS, LOG_FEATURES
+
+
+def create_training_set(rng, count):
+    # log encoded counts and rates like the features of the feature store, with ties between the rows
+    features = rng.poisson(5, (count, len(FEATURE_LABELS))).astype(np.float64)
+    features[:, LOG_FEATURES] = np.log10(features[:, LOG_FEATURES] + 1)
+    defects = features[:, 0] + rng.normal(0, 0.3, count) > np.median(features[:, 0])
+    return features, defects
+
+
+def compile_forest(clf, path):
+    save_forest(clf, path, "owner/name", "0" * 40, FEATURE_LABELS)
+    return CompiledForest(path)
+
+
+@pytest.mark.parametrize("params", [DEFAULT_PARAMS, {**DEFAULT_PARAMS, "max_depth": 10}, {"n_estimators": 5}])
+def test_compiled_forest_matches_random_forest(tmp_path, params):
+    rng = np.random.default_rng(0)
+    features, defects = create_training_set(rng, 400)
+    clf = RandomForestClassifier(**params, random_state=42).fit(features, defects)
+    forest = compile_forest(clf, tmp_path / "model.forest")
+    # the training rows hit the thresholds exactly, the noisy rows fall between them
+    unseen_features = np.vstack([features, features + rng.normal(0, 0.2, features.shape),
+                                 create_training_set(rng, 100)[0]])
+
+    np.testing.assert_allclose(forest.predict_proba(unseen_features), clf.predict_proba(unseen_features))
+    assert forest.repository == "owner/name" and forest.feature_labels == FEATURE_LABELS
+
+
+def test_compiled_forest_matches_warm_started_forest(tmp_path):
+    rng = np.random.default_rng(1)
+    features, defects = create_training_set(rng, 300)
+    clf = RandomForestClassifier(**DEFAULT_PARAMS, random_state=42).fit(features[:200], defects[:200])
+    clf.set_params(n_estimators=clf.n_estimators + WARM_START_TREES, warm_start=True)
+    clf.fit(features, defects)
+    forest = compile_forest(clf, tmp_path / "model.forest")
+
+    np.testing.assert_allclose(forest.predict_proba(features), clf.predict_proba(features))
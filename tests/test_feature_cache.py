@@ -0,0 +1,63 @@
+from feature_cache import FeatureCache
+from github_adapter import GithubAdapter
+
+COMMIT_LIMIT = 100
+
+
+def get_features(server, repository, sha, cache):
+    """ Returns the features of the examined window, with the changed files as comparable tuples """
+    adapter = GithubAdapter("token", repository.repository, sha, cache, api_url=server.url,
+                            commit_limit=COMMIT_LIMIT)
+    features = []
+    for commit in adapter.iter_features():
+        row = commit.get_all()
+        row["files"] = [(file.filename, file.changes, file.previous_filename) for file in row["files"]]
+        features.append(row)
+    return features
+
+
+def assert_cached_run_matches(server, repository, sha, cache):
+    assert get_features(server, repository, sha, cache) == get_features(server, repository, sha, None)
+
+
+def test_cached_runs_match_runs_without_cache(replay_server, synthetic_repository, tmp_path):
+    cache = FeatureCache(str(tmp_path / "cache.sqlite"))
+    shas = [commit["sha"] for commit in synthetic_repository.commits]
+
+    assert_cached_run_matches(replay_server, synthetic_repository, shas[139], cache)
+    # the window slid past the oldest cached commits
+    assert_cached_run_matches(replay_server, synthetic_repository, shas[-1], cache)
+    # an older target reuses the cached commits and keeps the cached head
+    assert_cached_run_matches(replay_server, synthetic_repository, shas[119], cache)
+    assert cache.load_snapshot(get_cache_key(cache))[1] == shas[-1]
+    assert_cached_run_matches(replay_server, synthetic_repository, shas[-1], cache)
+
+
+def test_rewritten_history_rebuilds_the_cache(replay_server, synthetic_repository, tmp_path):
+    cache = FeatureCache(str(tmp_path / "cache.sqlite"))
+    shas = [commit["sha"] for commit in synthetic_repository.commits]
+    get_features(replay_server, synthetic_repository, shas[149], cache)
+    # a force-pushed head is neither part of the examined history nor related to the target
+    cache.connection.execute("UPDATE snapshots SET head_sha = ?", ("0" * 40,))
+    cache.connection.commit()
+
+    assert_cached_run_matches(replay_server, synthetic_repository, shas[-1], cache)
+    assert cache.load_snapshot(get_cache_key(cache))[1] == shas[-1]
+
+
+def test_unsettled_ci_is_refreshed(replay_server, synthetic_repository, tmp_path):
+    cache = FeatureCache(str(tmp_path / "cache.sqlite"))
+    commits = synthetic_repository.commits
+    commits[-3].update(states=["pending"], conclusions=[])
+    commits[-2].update(states=[], conclusions=[])
+    get_features(replay_server, synthetic_repository, commits[-1]["sha"], cache)
+    commits[-3].update(states=["success"])
+    commits[-2].update(conclusions=["failure"])
+
+    features = get_features(replay_server, synthetic_repository, commits[-1]["sha"], cache)
+    assert [commit["ci_state"] for commit in features[-3:-1]] == ["success", "failure"]
+    assert_cached_run_matches(replay_server, synthetic_repository, commits[-1]["sha"], cache)
+
+
+def get_cache_key(cache):
+    return cache.connection.execute("SELECT cache_key FROM snapshots").fetchone()[0]
@@ -0,0 +1,99 @@
+from commit import Commit
+from feature_extractor import FeatureExtractor
+from records import CommitRecord, FileRecord
+from replay_server import SyntheticRepository
+
+HISTORY_FEATURES = ["total_experience", "avg_file_complexity", "highest_file_complexity", "previous_change_count",
+                    "avg_experience", "lowest_experience", "lowest_experience_proportion"]
+
+
+class DictHistory:
+
+    def __init__(self):
+        """ The history features computed with the path keyed dicts used before FileHistory """
+        self.file_exp_history = {}
+        self.file_history = {}
+        self.exp_history = {}
+        self.file_detailed_history = {}
+
+    def get_features(self, sha, author, files):
+        features = {"total_experience": self.exp_history.get(author, 0)}
+        self.exp_history[author] = features["total_experience"] + 1
+        total_complexity = 0
+        highest_complexity = 0
+        previous_changes = set()
+        for file in files:
+            if file.previous_filename and file.previous_filename in self.file_history:
+                self.file_history[file.filename] = self.file_history.pop(file.previous_filename)
+                self.file_detailed_history[file.filename] = self.file_detailed_history.pop(file.previous_filename)
+                for author_experience in self.file_exp_history.values():
+                    if file.previous_filename in author_experience:
+                        author_experience[file.filename] = author_experience.pop(file.previous_filename)
+            if file.filename not in self.file_history:
+                self.file_history[file.filename] = 0
+                self.file_detailed_history[file.filename] = []
+            current_complexity = self.file_history[file.filename]
+            total_complexity += current_complexity
+            highest_complexity = max(highest_complexity, current_complexity)
+            previous_changes = previous_changes.union(self.file_detailed_history[file.filename])
+            self.file_history[file.filename] += 1
+            self.file_detailed_history[file.filename].append(sha)
+        features["avg_file_complexity"] = 0 if len(files) == 0 else total_complexity / len(files)
+        features["highest_file_complexity"] = highest_complexity
+        features["previous_change_count"] = len(previous_changes)
+        total_experience = 0
+        lowest_experience = 0
+        lowest_experience_prop = 1
+        author_experience = self.file_exp_history.setdefault(author, {})
+        for file in files:
+            current_experience = author_experience.get(file.filename, 0)
+            total_experience += current_experience
+            lowest_experience = min(lowest_experience, current_experience)
+            author_experience[file.filename] = current_experience + 1
+            current_file_complexity = self.file_history[file.filename] - 1
+            current_experience_prop = 1 if current_file_complexity == 0 \
+                else current_experience / current_file_complexity
+            lowest_experience_prop = min(lowest_experience_prop, current_experience_prop)
+        features["avg_experience"] = 0 if len(files) == 0 else total_experience / len(files)
+        features["lowest_experience"] = lowest_experience
+        features["lowest_experience_proportion"] = lowest_experience_prop
+        return features
+
+
+def compare_histories(commits):
+    extractor = FeatureExtractor()
+    dict_history = DictHistory()
+    rename_count = 0
+    for sha, author, files in commits:
+        commit = Commit()
+        commit.add("sha", sha)
+        extractor.add_change_properties(CommitRecord(sha, author, "", files), commit, author)
+        assert {feature: commit.get(feature) for feature in HISTORY_FEATURES} == \
+            dict_history.get_features(sha, author, files), sha
+        rename_count += sum(file.previous_filename is not None for file in files)
+    return rename_count
+
+
+def test_synthetic_history_matches_dict_history():
+    repository = SyntheticRepository(1500, seed=7)
+    commits = [(commit["sha"], commit["author"],
+                [FileRecord(file["filename"], file["additions"], file["deletions"], file["previous_filename"])
+                 for file in commit["files"]]) for commit in repository.commits]
+
+    assert compare_histories(commits) > 10
+
+
+def test_renames_onto_changed_paths_match_dict_history():
+    commits = [
+        ("1", "alice", [FileRecord("a.py", 1, 0), FileRecord("b.py", 2, 0)]),
+        ("2", "bob", [FileRecord("b.py", 1, 1)]),
+        # a rename onto a path with a history of its own, both authors keep experience with it
+        ("3", "carol", [FileRecord("b.py", 0, 0, "a.py")]),
+        ("4", "bob", [FileRecord("b.py", 3, 0), FileRecord("c.py", 1, 0)]),
+        # a rename of a path which was never seen, and a rename back to the original path
+        ("5", "alice", [FileRecord("d.py", 1, 0, "unknown.py"), FileRecord("a.py", 1, 0, "b.py")]),
+        ("6", "alice", [FileRecord("a.py", 1, 0), FileRecord("c.py", 1, 0), FileRecord("d.py", 1, 0)]),
+        ("7", None, [FileRecord("c.py", 1, 0), FileRecord("a.py", 1, 0)]),
+    ]
+
+    assert compare_histories(commits) == 3
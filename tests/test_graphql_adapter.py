@@ -0,0 +1,47 @@
+from github_adapter import GithubAdapter
+from graphql_adapter import GraphqlAdapter, CHECK_RUN_LIMIT, HISTORY_PAGE_SIZE
+from replay_server import ReplayServer, SyntheticRepository
+
+
+class ExpectedStatusRepository(SyntheticRepository):
+
+    def history(self, variables):
+        """ Reports the pending statuses as expected ones, like the statuses of required contexts """
+        history = super().history(variables)
+        for node in history["nodes"]:
+            for context in node["status"]["contexts"] if node["status"] else []:
+                if context["state"] == "PENDING":
+                    context["state"] = "EXPECTED"
+        return history
+
+
+def get_features(adapter):
+    features = []
+    for commit in adapter.iter_features():
+        row = commit.get_all()
+        row["files"] = [(file.filename, file.changes, file.previous_filename) for file in row["files"]]
+        features.append(row)
+    return features
+
+
+def test_graphql_features_match_rest_features():
+    repository = ExpectedStatusRepository(2 * HISTORY_PAGE_SIZE + 50, seed=2)
+    commits = repository.commits
+    commits[10].update(states=["pending", "error"])
+    commits[20].update(states=["pending"], conclusions=["success", "cancelled"])
+    # the check runs beyond the limit of the query are requested from the REST API
+    commits[30].update(states=[], conclusions=["success"] * (CHECK_RUN_LIMIT + 5) + ["failure"] * 5)
+    server = ReplayServer(repository).start()
+    try:
+        rest_adapter = GithubAdapter("token", repository.repository, None, api_url=server.url)
+        graphql_adapter = GraphqlAdapter("token", repository.repository, None, url=server.graphql_url,
+                                         api_url=server.url)
+        rest_features = get_features(rest_adapter)
+        graphql_features = get_features(graphql_adapter)
+    finally:
+        server.stop()
+
+    assert len(graphql_features) == len(commits)
+    assert graphql_features == rest_features
+    assert [graphql_features[i]["ci_state"] for i in [10, 20, 30]] == ["failure", "pending", "failure"]
+    assert graphql_features[30]["ci_count"] == CHECK_RUN_LIMIT + 10
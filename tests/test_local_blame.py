@@ -0,0 +1,116 @@
+import os
+import subprocess
+
+import pytest
+
+from local_blame import blame_fix, count_blamed_lines, get_changed_lines, unquote_path
+
+LINES = "".join(f"line {i}\n" for i in range(1, 11))
+
+
+class GitRepository:
+
+    def __init__(self, path):
+        """ A small work tree whose commits are blamed through its git directory, like a bare clone """
+        self.path = path
+        self.git_dir = str(path / ".git")
+        self.git("init", "--quiet")
+
+    def git(self, *args):
+        environment = {**os.environ, "GIT_AUTHOR_NAME": "developer", "GIT_AUTHOR_EMAIL": "developer@example.com",
+                       "GIT_COMMITTER_NAME": "developer", "GIT_COMMITTER_EMAIL": "developer@example.com"}
+        return subprocess.run(["git", "-C", str(self.path), *args], check=True, capture_output=True,
+                              encoding="utf-8", env=environment).stdout
+
+    def write(self, path, content):
+        mode = "wb" if isinstance(content, bytes) else "w"
+        with open(self.path / path, mode) as file:
+            file.write(content)
+
+    def commit(self, message):
+        self.git("add", "--all")
+        self.git("commit", "--quiet", "--message", message)
+        return self.git("rev-parse", "HEAD").strip()
+
+    def diff(self, sha):
+        return self.git("diff", "-U0", "-M", "--no-color", "--no-ext-diff", "--src-prefix=a/", "--dst-prefix=b/",
+                        f"{sha}^", sha)
+
+
+@pytest.fixture
+def repository(tmp_path):
+    return GitRepository(tmp_path)
+
+
+def test_insertion_at_the_first_line_blames_the_first_line(repository):
+    repository.write("file.txt", LINES)
+    defect = repository.commit("Add file.txt")
+    repository.write("file.txt", "header\n" + LINES)
+    fix = repository.commit("Fix file.txt")
+
+    assert get_changed_lines(repository.diff(fix), ["file.txt"]) == {"file.txt": ("file.txt", [(1, 1)])}
+    assert blame_fix(repository.git_dir, fix, ["file.txt"], 1000) == {"file.txt": {defect: 1}}
+
+
+def test_renamed_files_are_blamed_under_their_old_path(repository):
+    repository.write("old.txt", LINES)
+    defect = repository.commit("Add old.txt")
+    repository.git("mv", "old.txt", "new.txt")
+    repository.write("new.txt", LINES.replace("line 2\n", "fixed line 2\n").replace("line 3\n", "fixed line 3\n"))
+    fix = repository.commit("Fix new.txt")
+
+    assert get_changed_lines(repository.diff(fix), ["new.txt"]) == {"new.txt": ("old.txt", [(2, 3)])}
+    assert blame_fix(repository.git_dir, fix, ["new.txt"], 1000) == {"new.txt": {defect: 2}}
+
+
+def test_quoted_paths_are_blamed(repository):
+    path = 'dir ü/"quoted" file.txt'
+    os.mkdir(repository.path / "dir ü")
+    repository.write(path, LINES)
+    defect = repository.commit("Add a quoted path")
+    repository.write(path, LINES.replace("line 5\n", "fixed line 5\n"))
+    fix = repository.commit("Fix a quoted path")
+
+    assert '"a/dir \\303\\274/\\"quoted\\" file.txt"' in repository.diff(fix)
+    assert get_changed_lines(repository.diff(fix), [path]) == {path: (path, [(5, 5)])}
+    assert blame_fix(repository.git_dir, fix, [path], 1000) == {path: {defect: 1}}
+
+
+def test_binary_files_are_not_blamed(repository):
+    repository.write("image.bin", bytes(range(256)))
+    repository.write("file.txt", LINES)
+    defect = repository.commit("Add files")
+    repository.write("image.bin", bytes(reversed(range(256))))
+    repository.write("file.txt", LINES.replace("line 1\n", "fixed line 1\n"))
+    fix = repository.commit("Fix files")
+
+    assert get_changed_lines(repository.diff(fix), ["image.bin", "file.txt"]) == {"file.txt": ("file.txt", [(1, 1)])}
+    assert blame_fix(repository.git_dir, fix, ["image.bin", "file.txt"], 1000) == {"image.bin": {},
+                                                                                   "file.txt": {defect: 1}}
+
+
+def test_files_over_the_size_limit_are_skipped(repository):
+    repository.write("large.txt", LINES)
+    repository.write("small.txt", "line 1\n")
+    defect = repository.commit("Add files")
+    repository.write("large.txt", LINES.replace("line 1\n", "fixed line 1\n"))
+    repository.write("small.txt", "fixed line 1\n")
+    fix = repository.commit("Fix files")
+
+    assert blame_fix(repository.git_dir, fix, ["large.txt", "small.txt"], len(LINES) - 1) == {
+        "large.txt": None, "small.txt": {defect: 1}}
+
+
+def test_count_blamed_lines_sums_the_groups_of_each_commit():
+    first_sha = "a" * 40
+    second_sha = "b" * 40
+    blame = (f"{first_sha} 1 1 2\nauthor developer\nfilename file.txt\n"
+             f"{second_sha} 3 3 1\nprevious {first_sha} file.txt\nfilename file.txt\n"
+             f"{first_sha} 5 4 3\nfilename file.txt\n")
+
+    assert count_blamed_lines(blame) == {first_sha: 5, second_sha: 1}
+
+
+def test_unquote_path():
+    assert unquote_path("a/plain file.txt") == "a/plain file.txt"
+    assert unquote_path('"a/dir \\303\\274/\\"quoted\\"\\tfile.txt"') == 'a/dir ü/"quoted"\tfile.txt'
@@ -0,0 +1,114 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from rate_limit import RateLimitScheduler, PACE_FRACTION
+
+LIMIT = 100
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        # the last response repeats once the others were sent
+        responses = self.server.responses
+        status, headers, body = responses.pop(0) if len(responses) > 1 else responses[0]
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in {**headers, "Content-Type": "application/json", "Content-Length": len(payload)}.items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class RecordingScheduler(RateLimitScheduler):
+
+    def __init__(self):
+        """ A scheduler which records its delays instead of sleeping """
+        super().__init__()
+        self.delays = []
+
+    def sleep(self, delay):
+        if delay > 0:
+            self.delays.append(delay)
+
+
+@pytest.fixture
+def mock_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockHandler)
+    server.daemon_threads = True
+    server.responses = []
+    server.url = f"http://127.0.0.1:{server.server_port}/repos/owner/name"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get_rate_limit_headers(remaining, reset_delay):
+    return {"X-RateLimit-Limit": LIMIT, "X-RateLimit-Remaining": remaining,
+            "X-RateLimit-Reset": int(time.time() + reset_delay), "X-RateLimit-Resource": "core"}
+
+
+def test_full_budget_is_not_paced(mock_server):
+    mock_server.responses = [(200, get_rate_limit_headers(int(LIMIT * PACE_FRACTION) * 2, 60), {})]
+    scheduler = RecordingScheduler()
+    for _ in range(5):
+        assert scheduler.session.get(mock_server.url).status_code == 200
+
+    assert scheduler.delays == []
+
+
+def test_low_budget_is_spread_until_reset(mock_server):
+    # 10 requests remain for 10 seconds, the requests are one second apart
+    mock_server.responses = [(200, get_rate_limit_headers(10, 10), {})]
+    scheduler = RecordingScheduler()
+    for _ in range(3):
+        scheduler.session.get(mock_server.url)
+
+    assert scheduler.delays == [pytest.approx(1, abs=0.2), pytest.approx(2, abs=0.3)]
+
+
+def test_used_up_budget_pauses_until_reset(mock_server):
+    mock_server.responses = [(200, get_rate_limit_headers(0, 5), {})]
+    scheduler = RecordingScheduler()
+    scheduler.session.get(mock_server.url)
+    scheduler.session.get(mock_server.url)
+
+    assert scheduler.delays == [pytest.approx(6, abs=1)]
+
+
+def test_secondary_rate_limit_is_retried_after_the_given_delay(mock_server):
+    mock_server.responses = [(403, {"Retry-After": 7}, {"message": "You have exceeded a secondary rate limit"}),
+                             (200, get_rate_limit_headers(LIMIT, 60), {})]
+    scheduler = RecordingScheduler()
+
+    assert scheduler.session.get(mock_server.url).status_code == 200
+    assert scheduler.delays == [7]
+    assert scheduler.retry_count == 1
+
+
+def test_secondary_rate_limit_without_delay_backs_off(mock_server):
+    mock_server.responses = [(403, {}, {"message": "You have exceeded a secondary rate limit"}),
+                             (403, {}, {"message": "You have exceeded a secondary rate limit"}),
+                             (200, get_rate_limit_headers(LIMIT, 60), {})]
+    scheduler = RecordingScheduler()
+
+    assert scheduler.session.get(mock_server.url).status_code == 200
+    assert len(scheduler.delays) == 2
+    assert 1 <= scheduler.delays[0] <= 3 and 2 <= scheduler.delays[1] <= 6
+
+
+def test_other_forbidden_responses_are_not_retried(mock_server):
+    mock_server.responses = [(403, {}, {"message": "Resource not accessible by integration"})]
+    scheduler = RecordingScheduler()
+
+    assert scheduler.session.get(mock_server.url).status_code == 403
+    assert scheduler.retry_count == 0